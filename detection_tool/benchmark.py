@@ -0,0 +1,137 @@
+import numpy as np
+import argparse
+import time
+import cv2
+
+from detection_tool.transformation.image_function import Image
+from detection_tool.transformation.image_function import lightness
+from detection_tool.transformation.image_function import imclearborder
+from detection_tool.transformation.image_function import bwareaopen
+from detection_tool.transformation.image_function import clear_border
+from detection_tool.transformation.image_function import area_open
+from detection_tool.transformation.image_function import remove_components
+from detection_tool.transformation.reference_store import ReferenceStore
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-t", "--task", help="Benchmark task.", choices=['registration', 'filter', 'cleanup'], default='registration')
+parser.add_argument("-r", "--reference", help="Reference (golden) image path.")
+parser.add_argument("-i", "--images", help="Test image paths.", nargs='+', default=[])
+parser.add_argument("-n", "--repeat", help="Repetitions per image.", type=int, default=3)
+
+
+def corner_error(homography, baseline, shape):
+    """두 호모그래피로 옮긴 이미지 모서리의 최대 거리 (pixel)"""
+    height, width = shape[:2]
+    corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]]).reshape(-1, 1, 2)
+    a = cv2.perspectiveTransform(corners, homography)
+    b = cv2.perspectiveTransform(corners, baseline)
+
+    return float(np.max(np.linalg.norm(a - b, axis=2)))
+
+
+def timed(func, repeat):
+    """func 를 repeat 번 실행하고 (중간값 ms, 마지막 결과) 반환"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        s = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - s) * 1000)
+
+    return float(np.median(times)), result
+
+
+def benchmark_registration(args):
+    """매칭 방식 / 강건 추정 방식별 지연 시간과 inlier 품질 비교"""
+    reference = ReferenceStore().get(args.reference)
+    settings = [dict(matcher=matcher, estimator=estimator, max_matches=max_matches)
+                for matcher in ('bf', 'knn', 'flann')
+                for estimator in ('ransac', 'rho', 'usac')
+                for max_matches in (None, 500)]
+    settings += [dict(matcher='knn', pyramid_size=pyramid_size, refine=refine)
+                 for pyramid_size in (1000, 1600)
+                 for refine in (None, 'window', 'ecc')]
+    settings += [dict(matcher='knn', alignment=alignment) for alignment in ('phase', 'ecc', 'auto')]
+    if len(reference.fiducials) >= 3:
+        settings.append(dict(matcher='knn', alignment='fiducial'))
+
+    print('{:<12}{:<8}{:<8}{:>8}{:>8}{:>8}{:>10}{:>10}{:>10}{:>12}'.format(
+        'alignment', 'matcher', 'robust', 'top-n', 'pyramid', 'refine', 'ms', 'inliers', 'ratio', 'corner px'))
+    for path in args.images:
+        test_image = cv2.imread(path)
+        print('\n {} ({}x{})'.format(path, test_image.shape[1], test_image.shape[0]))
+        baseline, _ = Image().find_homography(test_image, reference=reference)
+
+        for kwargs in settings:
+            # A fresh Image per run, so 'auto' is measured without a previous homography to reuse.
+            ms, (homography, mask) = timed(
+                lambda: Image().find_homography(test_image, reference=reference, **kwargs), args.repeat)
+            inliers = int(mask.sum()) if mask is not None else 0
+            ratio = inliers / len(mask) if mask is not None else 0.
+            print('{:<12}{:<8}{:<8}{:>8}{:>8}{:>8}{:>10.1f}{:>10d}{:>10.2f}{:>12.2f}'.format(
+                kwargs.get('alignment', 'homography'), kwargs['matcher'], kwargs.get('estimator', 'ransac'),
+                str(kwargs.get('max_matches')), str(kwargs.get('pyramid_size')), str(kwargs.get('refine')), ms,
+                inliers, ratio, corner_error(homography, baseline, reference.shape)))
+
+
+def benchmark_filter(args):
+    """정확한 필터 단계와 빠른 형태학 근사의 지연 시간 / 정확도 비교"""
+    reference = ReferenceStore().get(args.reference)
+    height, width = reference.shape
+
+    print('{:<10}{:>10}{:>10}{:>14}{:>10}{:>10}'.format('morphology', 'ms', 'speedup', 'diff pixels', 'boxes',
+                                                        'matched'))
+    for path in args.images:
+        test_image = cv2.imread(path)
+        print('\n {} ({}x{})'.format(path, test_image.shape[1], test_image.shape[0]))
+        image = Image()
+        homography, _ = image.find_homography(test_image, reference=reference)
+        diff = image.image_comparison(cv2.warpPerspective(test_image, homography, (width, height)),
+                                      reference=reference)
+
+        exact_ms, exact = timed(lambda: image.image_filter(diff, morphology='exact').copy(), args.repeat)
+        exact_boxes = image.defect_boxes(exact)
+        for morphology in ('exact', 'fast'):
+            ms, filtered = timed(lambda: image.image_filter(diff, morphology=morphology).copy(), args.repeat)
+            boxes = image.defect_boxes(filtered)
+            # A box counts as matched when the exact result has a box with the same corner and size.
+            matched = len(set(map(tuple, boxes.tolist())) & set(map(tuple, exact_boxes.tolist())))
+            print('{:<10}{:>10.1f}{:>10.2f}{:>13.4f}%{:>10d}{:>10d}'.format(
+                morphology, ms, exact_ms / ms, 100. * np.count_nonzero(filtered != exact) / filtered.size,
+                len(boxes), matched))
+
+
+def benchmark_cleanup(args):
+    """lightness_gray 이진 이미지에서 contour 반복 구현과 배열 연산 구현 (remove_components) 의 지연 시간 / 차이 비교"""
+    print('{:<12}{:>10}{:>10}{:>10}{:>14}'.format('step', 'contours', 'ms', 'speedup', 'diff pixels'))
+    for path in args.images:
+        gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        # Only the binary map is needed here; the contour cleanup is timed below.
+        _, binary, _ = lightness().lightness_gray(gray, cleanup='components')
+        contours, _ = cv2.findContours(binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        print('\n {} ({}x{})'.format(path, binary.shape[1], binary.shape[0]))
+
+        cleared = binary
+        for step, exact, fast in (('clearborder', lambda b: imclearborder(b, 5), lambda b: clear_border(b, 5)),
+                                  ('areaopen', lambda b: bwareaopen(b, 120), lambda b: area_open(b, 120))):
+            exact_ms, expected = timed(lambda: exact(cleared), args.repeat)
+            ms, result = timed(lambda: fast(cleared), args.repeat)
+            print('{:<12}{:>10d}{:>10.1f}{:>10.2f}{:>13.4f}%'.format(
+                step, len(contours), ms, exact_ms / ms, 100. * np.count_nonzero(result != expected) / result.size))
+            cleared = expected
+        exact_ms, expected = timed(lambda: bwareaopen(imclearborder(binary, 5), 120), args.repeat)
+        ms, result = timed(lambda: remove_components(binary, radius=5, area=120), args.repeat)
+        print('{:<12}{:>10d}{:>10.1f}{:>10.2f}{:>13.4f}%'.format(
+            'both', len(contours), ms, exact_ms / ms, 100. * np.count_nonzero(result != expected) / result.size))
+
+
+TASKS = {
+    'registration': benchmark_registration,
+    'filter': benchmark_filter,
+    'cleanup': benchmark_cleanup,
+}
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    TASKS[args.task](args)
@@ -6,8 +6,6 @@ import sys
 import cv2
 import os
 
-from tensorflow.keras.preprocessing.image import load_img
-from tensorflow.keras.preprocessing.image import img_to_array
 from tensorflow.keras.models import load_model
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtWidgets import QDialog
@@ -18,14 +16,49 @@ from matplotlib import pyplot as plt
 from tqdm import tqdm
 
 from detection_tool import siamese
+from detection_tool.transformation.crop_batch import CropBatch
+from detection_tool.transformation.crop_batch import CROP_BATCH_FILE
+from detection_tool.transformation.crop_store import CropStore
+from detection_tool.transformation.image_writer import ImageWriter
+from detection_tool.transformation.defect_labels import relabel_defects
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-m", "--model_type", help="Pre-trained Model type.", default='default')
 parser.add_argument("-c", "--class_info", help="Class information.")
 parser.add_argument("-p", "--path_info", help="Path information.")
-args = parser.parse_args()
+# Parsed in __main__ only, so demo_watch can import the classifier below.
+args = None
 
 TIME_LIMIT = 100
+DEFAULT_MODEL_FILE = 'pcb_72-0.0387_VGG19.hdf5'
+SIAMESE_MODEL_FILE = 'one_way_model.h5'
+# Predictions below these scores are labelled 'None'.
+DEFAULT_THRESHOLD = .95
+SIAMESE_THRESHOLD = .92
+
+
+def load_classifier(model_type, path_info):
+    """
+    분류 모델 읽기
+    Keyword arguments:
+    :param model_type: default, siamese
+    :param path_info: 설정 파일의 paths 항목
+    :return model, x_support, cat_support, indices_support: 모델, siamese 비교 이미지 / 분류 / index (default 는 None)
+    """
+    model_base_path = os.path.abspath(path_info['model_base_path'])
+    model = None
+    x_support = None
+    cat_support = None
+    indices_support = None
+    if model_type == 'default':
+        model = load_model(os.path.join(model_base_path, DEFAULT_MODEL_FILE))
+    if model_type == 'siamese':
+        model = siamese.build_network(shape=(32, 32, 3))
+        model.load_weights(os.path.join(model_base_path, SIAMESE_MODEL_FILE))
+        x_support, y_support, cat_support = siamese.load_data(os.path.abspath(path_info['siamese_support_path']))
+        indices_support = siamese.create_indices(np.array(y_support), len(cat_support))
+
+    return model, x_support, cat_support, indices_support
 
 
 class External(QThread):
@@ -40,34 +73,29 @@ class External(QThread):
         class_info = eval(args.class_info)
 
         model_type = args.model_type
-        model_base_path = os.path.abspath(path_info['model_base_path'])
         crop_path = os.path.abspath(path_info['crop_path'])
         origin_path = os.path.abspath(path_info['origin_path'])
         labeled_path = os.path.abspath(path_info['labeled_path'])
         result_path = os.path.abspath(path_info['eval_result_path'])
         result_path_text = os.path.abspath(path_info['eval_result_path_text'])
         result_path_total = os.path.abspath(path_info['eval_result_path_total'])
+        crop_store_path = path_info.get('crop_store_path')
+        label_path = path_info.get('label_path')
 
         s = time.time()
 
-        model = None
-        x_support = None
-        cat_support = None
-        indices_support = None
-        if model_type == 'default':
-            model = load_model(os.path.join(model_base_path, 'pcb_72-0.0387_VGG19.hdf5'))
-        if model_type == 'siamese':
-            model = siamese.build_network(shape=(32, 32, 3))
-            model.load_weights(os.path.join(model_base_path, 'one_way_model.h5'))
-            x_support, y_support, cat_support = siamese.load_data(os.path.abspath(path_info['siamese_support_path']))
-            indices_support = siamese.create_indices(np.array(y_support), len(cat_support))
+        model, x_support, cat_support, indices_support = load_classifier(model_type, path_info)
         model.summary()
 
         count = 10
         load_data = self.load_data(crop_path)
         inputdata = load_data.pop('data')
+        crops = load_data.pop('crops')
         filenames = load_data.pop('filenames')
         filepaths = load_data.pop('filepaths')
+        ids = load_data.pop('ids')
+        sources = load_data.pop('sources')
+        inspected = load_data.pop('inspected')
         n_samples = load_data.pop('n_samples')
         categories = list(class_info.values())
 
@@ -95,29 +123,47 @@ class External(QThread):
                     origin_file.append(file_name)
 
         print('\n ========== Auto labelling task. ===========')
+        # With a crop store the labels are recorded against the stored crops instead of copying files per class.
+        crop_store = CropStore(os.path.abspath(crop_store_path)) if crop_store_path and ids else None
+        writer = ImageWriter()
+        defect_labels = {}
         for i in range(n_samples):
             filename = filenames[i]
-            crop_file = filepaths[i]
 
             defect_type = None
+            score = None
             if model_type == 'default':
-                if predict[i][predict_idx[i]] >= .95:
+                score = predict[i][predict_idx[i]]
+                if score >= DEFAULT_THRESHOLD:
                     defect_type = class_info[predict_idx[i]]
                 else:
                     defect_type = 'None'
             if model_type == 'siamese':
-                if 1 - predict[i][predict_idx[i]] >= .92:
+                score = 1 - predict[i][predict_idx[i]]
+                if score >= SIAMESE_THRESHOLD:
                     defect_type = class_info[predict_idx[i]]
                 else:
                     defect_type = 'None'
                     predict_idx[i] = -1
 
+            if sources[i]:
+                defect_labels.setdefault(sources[i], []).append(defect_type)
+            if crop_store is not None:
+                crop_store.relabel(ids[i], defect_type, score)
+                continue
             save_path = os.path.join(labeled_path, defect_type)
             if not os.path.exists(save_path):
                 os.makedirs(save_path)
-            cv2.imwrite(os.path.join(save_path, filename), cv2.imread(crop_file))
-
-        result_list = [len(origin_file), n_samples, 0., '/'.join(map(str, predict_idx))]
+            writer.write(os.path.join(save_path, filename), crops[i])
+        writer.close()
+        if crop_store is not None:
+            crop_store.close()
+        # Boxes were written in crop order, so the classes can be filled in the same order.
+        for source, labels in defect_labels.items():
+            relabel_defects(source, labels, os.path.abspath(label_path) if label_path else None)
+
+        # Without annotated boards in origin_path the inspected boards are counted from the crop batch.
+        result_list = [len(inspected) if inspected else len(origin_file), n_samples, 0., '/'.join(map(str, predict_idx))]
         with open(result_path_text, 'w', encoding='utf-8') as f:
             f.write('/'.join(map(str, result_list)))
 
@@ -125,11 +171,8 @@ class External(QThread):
         self.countChanged.emit(count)
 
         print('\n ========== Creating chart task ===========')
-        test_image = np.ndarray((n_samples, 32, 32, 3))
-        for i in range(n_samples):
-            img = load_img(filepaths[i])
-            img = img_to_array(img)
-            test_image[i] = img / 255
+        # The model input is BGR; the chart shows RGB.
+        test_image = inputdata[..., ::-1]
 
         num_cols = 1
         num_rows = math.ceil(n_samples / num_cols)
@@ -160,7 +203,18 @@ class External(QThread):
                 self.countChanged.emit(count)
 
     def load_data(self, path, size=(32, 32)):
+        # demo_xor hands the crops over as one array file; JPEG crops are only read when it is missing.
+        batch_file = os.path.join(path, CROP_BATCH_FILE)
+        if os.path.exists(batch_file):
+            crop_batch = CropBatch.load(batch_file)
+            crop_batch.crops = [crop if crop.shape[:2] == size[::-1] else cv2.resize(crop, size, cv2.INTER_CUBIC)
+                                for crop in crop_batch.crops]
+            return {'data': crop_batch.batch(), 'crops': crop_batch.crops, 'filenames': crop_batch.names,
+                    'filepaths': [os.path.join(path, name) for name in crop_batch.names], 'ids': crop_batch.ids,
+                    'sources': crop_batch.sources, 'inspected': crop_batch.inspected, 'n_samples': len(crop_batch)}
+
         x = []
+        crops = []
         filenames = []
         filepaths = []
         n_samples = 0
@@ -168,11 +222,13 @@ class External(QThread):
             image_path = os.path.join(path, filename)
             image = cv2.resize(cv2.imread(image_path), size, cv2.INTER_CUBIC)
             x.append(image.astype(np.float32) / 255.)
+            crops.append(image)
             filenames.append(filename)
             filepaths.append(image_path)
             n_samples += 1
 
-        return {'data': np.array(x), 'filenames': filenames, 'filepaths': filepaths, 'n_samples': n_samples}
+        return {'data': np.array(x), 'crops': crops, 'filenames': filenames, 'filepaths': filepaths, 'ids': [],
+                'sources': [''] * n_samples, 'inspected': [], 'n_samples': n_samples}
 
 
 class Actions(QDialog):
@@ -267,6 +323,7 @@ def plot_value_array(i, predictions_array, true_labels, categories, model_type):
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
     app = QApplication(sys.argv)
     window = Actions()
     sys.exit(app.exec_())
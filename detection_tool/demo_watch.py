@@ -0,0 +1,196 @@
+import collections
+import numpy as np
+import argparse
+import signal
+import json
+import time
+import sys
+import os
+
+from detection_tool import siamese
+from detection_tool.demo_evaluation import load_classifier
+from detection_tool.demo_evaluation import DEFAULT_THRESHOLD
+from detection_tool.demo_evaluation import SIAMESE_THRESHOLD
+from detection_tool.transformation.board_inspector import BoardInspector
+from detection_tool.transformation.folder_watcher import FolderWatcher
+from detection_tool.transformation.image_writer import ImageWriter
+from detection_tool.transformation.manifest import manifest_entry
+from detection_tool.transformation.defect_labels import relabel_defects
+from detection_tool.transformation.workspace import RunWorkspace
+from detection_tool.transformation.workspace import KEEP_RUNS
+
+parser = argparse.ArgumentParser(description='Inspect and classify boards as they are dropped into a folder.')
+parser.add_argument("-i", "--input", help="Watched folder (default: paths.xor_test_path).")
+parser.add_argument("-o", "--output", help="Results file, one JSON line per board (default: watch_results_path).")
+parser.add_argument("-m", "--model_type", help="Pre-trained Model type.", default='default')
+parser.add_argument("-c", "--class_info", help="Class information.")
+parser.add_argument("-p", "--path_info", help="Path information.")
+parser.add_argument("-d", "--detection_info", help="Detection options.", default='{}')
+parser.add_argument("--polling", help="Poll the folder even if watchdog is installed.", action='store_true')
+parser.add_argument("--no-cache", help="Inspect every board again, ignoring the artifact cache.", dest='cache',
+                    action='store_false')
+args = parser.parse_args()
+
+
+class Classifier:
+    """결함 이미지 분류 (demo_evaluation 과 같은 모델 / 기준, 모델은 한 번만 읽음)"""
+    def __init__(self, model_type, path_info, class_info):
+        """
+        Keyword arguments:
+        :param model_type: default, siamese
+        :param path_info: 설정 파일의 paths 항목
+        :param class_info: 설정 파일의 classes 항목
+        """
+        if model_type not in ('default', 'siamese'):
+            raise ValueError('Unknown model type: {}'.format(model_type))
+        self.model_type = model_type
+        self.class_info = class_info
+        self.model, self.x_support, self.cat_support, self.indices_support = load_classifier(model_type, path_info)
+
+    def classify(self, crop_batch):
+        """
+        Keyword arguments:
+        :param crop_batch: 보드 하나의 CropBatch
+        :return: 결함 이미지 순서대로 [(분류, 점수), ...] (기준 점수 미만은 'None')
+        """
+        if not len(crop_batch):
+            return []
+        inputdata = crop_batch.batch()
+
+        labels = []
+        if self.model_type == 'default':
+            for pred in self.model.predict(inputdata):
+                idx = int(np.argmax(pred))
+                score = float(pred[idx])
+                labels.append((self.class_info[idx] if score >= DEFAULT_THRESHOLD else 'None', score))
+        else:
+            for query in inputdata:
+                pred = siamese.predict(self.model, query, self.x_support, self.indices_support, self.cat_support)
+                idx = int(np.argmin(pred))
+                score = float(1 - pred[idx])
+                labels.append((self.class_info[idx] if score >= SIAMESE_THRESHOLD else 'None', score))
+
+        return labels
+
+
+def read_done(results_path):
+    """결과 파일에 이미 있는 보드 (재시작 시 다시 검사하지 않음, 실패한 보드는 제외해서 다시 검사)"""
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash; the board is simply inspected again.
+                continue
+            if record.get('verdict') != 'error' and 'board' in record:
+                done.add(record['board'])
+
+    return done
+
+
+def process(board, inspector, classifier, path_info, annotation):
+    """
+    보드 한 장 검사 + 분류
+    Keyword arguments:
+    :param board: 테스트 이미지 경로
+    :param inspector: BoardInspector
+    :param classifier: Classifier
+    :param path_info: 설정 파일의 paths 항목
+    :param annotation: detection.annotation
+    :return: 결과 한 줄 {board, class, verdict, defects, cached, elapsed, latency}
+    """
+    s = time.time()
+    entry = manifest_entry(board, os.path.abspath(path_info['xor_normal_path']))
+    result = inspector.inspect(entry['board'], entry['class'], entry['reference'])
+    crop_batch = result['crops']
+    labels = classifier.classify(crop_batch)
+    if annotation == 'label':
+        relabel_defects(entry['board'], [label for label, _ in labels], inspector.label_path)
+
+    defects = [{'name': name, 'box': [int(v) for v in box], 'class': label, 'score': score}
+               for name, box, (label, score) in zip(crop_batch.names, crop_batch.boxes, labels)]
+    e = time.time()
+
+    return {'board': entry['board'], 'class': entry['class'], 'verdict': 'defect' if defects else 'pass',
+            'defects': defects, 'cached': bool(result['stats']['cached_boards']), 'elapsed': round(e - s, 3),
+            # Capture-to-verdict: measured from the file's last write.
+            'latency': round(e - os.path.getmtime(entry['board']), 3),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def main():
+    path_info = eval(args.path_info)
+    class_info = eval(args.class_info)
+    detection_info = eval(args.detection_info)
+    watch_info = detection_info.get('watch', {})
+    input_path = os.path.abspath(args.input or path_info['xor_test_path'])
+    results_path = os.path.abspath(args.output or path_info['watch_results_path'])
+    os.makedirs(os.path.dirname(results_path), exist_ok=True)
+
+    # Crops and annotated boards of this session go to their own workspace, published when the daemon stops.
+    workspace = RunWorkspace.create(path_info['runs_path'])
+    run_path_info = workspace.paths(path_info)
+    writer = ImageWriter(workers=detection_info.get('writer_workers', 2))
+    inspector = BoardInspector(detection_info, run_path_info, writer=writer, use_cache=args.cache)
+    classifier = Classifier(args.model_type, path_info, class_info)
+    stats = collections.Counter()
+    retries = watch_info.get('retries', 5)
+
+    watcher = FolderWatcher(input_path, settle=watch_info.get('settle', 0.5), interval=watch_info.get('interval', 0.2),
+                            events=watch_info.get('events', True) and not args.polling,
+                            retry_delay=watch_info.get('retry_delay', 10.))
+    watcher.done.update(read_done(results_path))
+    # A service manager stops the daemon with SIGTERM; the workspace is still published on the way out.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    mode = 'events' if watcher.uses_events else 'polling'
+    print('\n ******************' + 'Watching {} ({})'.format(input_path, mode) + '******************')
+    try:
+        with open(results_path, 'a', encoding='utf-8') as f:
+            while True:
+                for board in watcher.poll():
+                    try:
+                        record = process(board, inspector, classifier, path_info,
+                                         detection_info.get('annotation', 'image'))
+                    except Exception as e:
+                        # One unreadable board (or one without a reference) must not stop the line.
+                        record = {'board': board, 'verdict': 'error', 'error': str(e),
+                                  'attempt': watcher.failures[board] + 1, 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+                        # Tried again later with a growing delay, e.g. once its reference has been copied in.
+                        if watcher.failures[board] < retries:
+                            record['retry_in'] = watcher.retry(board)
+                    # One line per board, flushed at once, so readers can tail the file.
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    f.flush()
+                    stats[record['verdict']] += 1
+                    if record['verdict'] == 'error':
+                        print(' {} : error ({}), {}'.format(
+                            os.path.basename(board), record['error'],
+                            '{:.0f} s 후 재시도'.format(record['retry_in']) if 'retry_in' in record else '재시도하지 않음'))
+                    else:
+                        print(' {} : {} ({} defects, {} s)'.format(os.path.basename(board), record['verdict'],
+                                                                   len(record['defects']), record['latency']))
+                watcher.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        try:
+            watcher.close()
+            writer.close()
+        finally:
+            # Runs even if a pending write fails, so the staging directory is never left behind.
+            # An idle session leaves no run behind, so LATEST keeps pointing at the last run with results.
+            if stats:
+                workspace.publish()
+                runs_info = detection_info.get('runs', {})
+                RunWorkspace.prune(path_info['runs_path'], keep=runs_info.get('keep', KEEP_RUNS),
+                                   max_age=runs_info.get('max_age_days'))
+            else:
+                workspace.discard()
+            print('\n 검사 보드 수 : {}'.format(dict(stats)))
+
+
+if __name__ == "__main__":
+    main()
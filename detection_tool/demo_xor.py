@@ -1,7 +1,7 @@
+import collections
 import argparse
 import shutil
 import time
-import cv2
 import sys
 import os
 
@@ -12,12 +12,27 @@ from PyQt5.QtCore import QThread
 from PyQt5.QtCore import pyqtSignal
 from tqdm import tqdm
 
-from detection_tool.transformation.image_function import Image
+from detection_tool.transformation.filter_chain import FilterChain
+from detection_tool.transformation.board_inspector import inspect_boards
+from detection_tool.transformation.board_inspector import pool_workers
+from detection_tool.transformation.board_inspector import open_cache
+from detection_tool.transformation.crop_batch import CropBatch
+from detection_tool.transformation.crop_batch import CROP_BATCH_FILE
+from detection_tool.transformation.crop_store import CropStore
+from detection_tool.transformation.image_writer import ImageWriter
+from detection_tool.transformation.manifest import read_manifest
+from detection_tool.transformation.manifest import count_manifest
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-i', '--individual_path', help='Individual inspection progress', nargs='+', default=[])
+parser.add_argument("-m", "--manifest", help="Board manifest (JSON lines of board, reference, class).")
 parser.add_argument("-c", "--class_info", help="Class information.")
 parser.add_argument("-p", "--path_info", help="Path information.")
+parser.add_argument("-d", "--detection_info", help="Detection options.", default='{}')
+parser.add_argument("-w", "--workers", help="Board worker processes (default: detection.workers).", type=int,
+                    default=None)
+parser.add_argument("--no-cache", help="Inspect every board again, ignoring the artifact cache.", dest='cache',
+                    action='store_false')
 args = parser.parse_args()
 
 TIME_LIMIT = 100
@@ -34,15 +49,30 @@ class External(QThread):
 
         path_info = eval(args.path_info)
         class_info = eval(args.class_info)
+        detection_info = eval(args.detection_info)
+        workers = args.workers if args.workers is not None else detection_info.get('workers', 1)
+        if pool_workers(workers, detection_info) < workers:
+            # The alignment history has to follow the board order, which only one process keeps.
+            print('\n registration.alignment: {} 은 직전 보드 정렬을 쓰므로 worker 1 개로 검사'.format(
+                detection_info['registration']['alignment']))
+            workers = 1
 
         crop_path = os.path.abspath(path_info['crop_path'])
         origin_path = os.path.abspath(path_info['origin_path'])
-        normal_path = os.path.abspath(path_info['xor_normal_path'])
         result_path = os.path.abspath(path_info['xor_result_path'])
         test_path = os.path.abspath(path_info['xor_test_path'])
         labeled_path = os.path.abspath(path_info['labeled_path'])
+        crop_store_path = path_info.get('crop_store_path')
         classes = class_info.values()
 
+        # Crops are handed to demo_evaluation as one array file instead of thousands of JPEGs.
+        crop_batch = CropBatch()
+        # JPEG encoding runs in the background; the loop only waits when the write queue is full.
+        writer = ImageWriter(workers=detection_info.get('writer_workers', 2))
+        # Stage names for the timing report; the stages themselves run in the inspectors.
+        filter_chain = FilterChain(detection_info.get('filter_chain'))
+        stats = collections.Counter()
+
         if os.path.exists(crop_path):
             shutil.rmtree(crop_path)
         if os.path.exists(origin_path):
@@ -51,45 +81,69 @@ class External(QThread):
             shutil.rmtree(result_path)
         if os.path.exists(labeled_path):
             shutil.rmtree(labeled_path)
+        os.makedirs(crop_path)
+        os.makedirs(result_path)
+
+        if args.manifest:
+            # Boards are streamed from the manifest into the workers; no test directory is listed.
+            total = count_manifest(args.manifest)
+            tasks = ((entry['board'], entry['class'], entry.get('reference'))
+                     for entry in read_manifest(args.manifest, classes))
+        else:
+            selected = set(args.individual_path)
+            tasks = []
+            for defect in classes:
+                _test_path = os.path.abspath(os.path.join(test_path, defect))
+                files = os.listdir(_test_path) if os.path.exists(_test_path) else []
+                for i in range(len(files)):
+                    if str(os.path.join(_test_path, files[i])).replace('\\', '/') in selected:
+                        tasks.append((os.path.join(_test_path, files[i]), defect))
+            total = len(tasks)
 
         print('\n ******************' + 'Start Defect Inspection' + '******************')
-        for defect in classes:
-            count += 100 / len(classes)
-            print('\n ----------------' + defect + '----------------')
-            _test_path = os.path.abspath(os.path.join(test_path, defect))
-            files = os.listdir(_test_path) if os.path.exists(_test_path) else []
-
-            if not os.path.exists(crop_path):
-                os.makedirs(crop_path)
-            if not os.path.exists(origin_path):
-                os.makedirs(origin_path)
-            if not os.path.exists(result_path):
-                os.makedirs(result_path)
-            if not os.path.exists(os.path.abspath(os.path.join(origin_path, defect))):
-                os.mkdir(os.path.abspath(os.path.join(origin_path, defect)))
-
-            tot_sum = 0
-            for i in tqdm(range(len(files))):
-                if str(os.path.join(_test_path, files[i])).replace('\\', '/') in args.individual_path:
-                    tot_sum += i
-                    test_image = cv2.imread(os.path.join(_test_path, files[i]))
-                    test_filename = files[i].split('_')[0] + '.JPG'
-                    ref_image = cv2.imread(os.path.join(normal_path, test_filename))
-                    transform_image = Image().registriation(test_image, ref_image)
-                    diff_image = Image().image_comparison(transform_image, ref_image)
-                    filtered_image = Image().image_filter(diff_image)
-                    _, _ = Image().image_defect(filtered_image, transform_image, size=32,
-                                                correction=20,
-                                                filename1=files[i].split('.')[0],
-                                                filename2=files[i],
-                                                crop_path=os.path.join(crop_path,),
-                                                origin_path=os.path.join(origin_path, defect),
-                                                result_path=result_path)
-            self.countChanged.emit(count)
-            print('\n 검출 파일 수 : ' + str(tot_sum))
+        print('\n 검사 보드 수 : {} (workers: {})'.format(total, workers))
+        results = []
+        for result in tqdm(inspect_boards(tasks, detection_info, path_info, workers=workers,
+                                          cv_threads=detection_info.get('worker_threads'), writer=writer,
+                                          use_cache=args.cache),
+                           total=total):
+            crop_batch.extend(result.pop('crops'))
+            stats.update(result.pop('stats'))
+            filter_chain.timings += result.pop('timings')
+            results.append(result)
+            count = 100 * len(results) / total
+            # 100 closes the dialog, so it is only reported once every write has been flushed.
+            self.countChanged.emit(int(min(count, 99)))
+        for defect, boards in collections.Counter(result['class'] for result in results
+                                                  if 'error' not in result).items():
+            print('\n {} 검출 파일 수 : {}'.format(defect, boards))
+        writer.close()
+        if crop_store_path:
+            # The packed store keeps every crop of every run; crops.npz carries their ids to the classifier.
+            with CropStore(os.path.abspath(crop_store_path)) as crop_store:
+                crop_batch.ids = crop_store.extend(crop_batch)
+        crop_batch.save(os.path.join(crop_path, CROP_BATCH_FILE))
         print('\n ******************' + 'Defect Extraction Completed' + '*************************')
+        if stats['failed_boards']:
+            print('\n 검사하지 못한 보드 수 : {} / {}'.format(stats['failed_boards'], len(results)))
+        if stats['cached_boards']:
+            print('\n 캐시 사용 보드 수 : {} / {}'.format(stats['cached_boards'], len(results)))
+        if stats['boards']:
+            print('\n 통과 보드 수 : {} / {}'.format(stats['skipped_boards'], stats['boards']))
+            print('\n 생략 pixel : {} / {} ({:.1f}%)'.format(
+                stats['skipped_pixels'], stats['pixels'], 100. * stats['skipped_pixels'] / stats['pixels']))
+        if stats['components']:
+            print('\n 제외된 결함 후보 : {} / {}'.format(stats['rejected_components'], stats['components']))
+        if stats['merged_boxes']:
+            print('\n 합쳐진 결함 후보 : {}'.format(stats['merged_boxes']))
+        for stage, ms in filter_chain.report().items():
+            print(' {:<28}{:>10.1f} ms'.format(stage, ms))
+        artifact_cache = open_cache(detection_info, path_info) if args.cache else None
+        if artifact_cache is not None:
+            print('\n 캐시에서 지운 항목 수 : {}'.format(artifact_cache.evict()))
         e = time.time()
         print(e - s)
+        self.countChanged.emit(100)
 
 
 class Actions(QDialog):
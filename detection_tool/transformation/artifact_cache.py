@@ -0,0 +1,166 @@
+import hashlib
+import json
+import time
+import numpy as np
+import os
+
+CACHE_VERSION = 2  # bump when the stored artifacts or the detection code change meaning
+MAX_SIZE = 2 * 1024 * 1024 * 1024  # bytes
+MAX_AGE = 30 * 24 * 60 * 60  # seconds
+TMP_GRACE = 60 * 60  # seconds before an unfinished .tmp file counts as left over from a crashed writer
+# Detection options that only change how a run is executed or written out, not what is detected.
+RUNTIME_KEYS = ('annotation', 'cache', 'runs', 'tile_workers', 'watch', 'worker_threads', 'workers', 'write_crops',
+                'writer_workers')
+
+
+def file_digest(path=None, data=None):
+    """파일 (또는 bytes) 내용의 sha1"""
+    digest = hashlib.sha1()
+    if data is not None:
+        digest.update(data)
+        return digest.hexdigest()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    """
+    보드별 검사 결과 (homography, 결함 영역, 결함 이미지) 캐시.
+    키는 테스트 이미지 내용 + 기준 이미지 내용 + 검출 설정 (+ 정렬 이력을 쓰면 직전 보드의 호모그래피) 의 hash 이므로,
+    하나라도 바뀌면 다시 검사한다.
+    항목 하나가 npz 파일 하나이며, 여러 worker 프로세스가 같이 써도 되도록 원자적으로 저장한다.
+    """
+    def __init__(self, path, max_size=MAX_SIZE, max_age=MAX_AGE):
+        """
+        Keyword arguments:
+        :param path: 캐시 디렉터리
+        :param max_size: 최대 전체 크기 (bytes, evict 참고)
+        :param max_age: 마지막 사용 후 유지 시간 (초)
+        """
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self._references = {}
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path, exist_ok=True)
+
+    def key(self, board, board_digest, reference, config, previous=None):
+        """
+        Keyword arguments:
+        :param board: 테스트 이미지 경로 (결함 이미지 이름이 파일 이름에서 나오므로 이름도 키에 포함)
+        :param board_digest: 테스트 이미지 내용 hash
+        :param reference: 기준 이미지 경로
+        :param config: 설정 파일의 detection 항목
+        :param previous: 직전 보드의 호모그래피 (reuse / auto / fiducial 정렬은 결과가 이것에 따라 달라짐)
+        :return: 캐시 키
+        """
+        config = {k: v for k, v in config.items() if k not in RUNTIME_KEYS}
+        text = json.dumps([CACHE_VERSION, os.path.basename(board), board_digest, self.reference_digest(reference),
+                           config, None if previous is None else np.asarray(previous).tolist()],
+                          sort_keys=True, default=str)
+
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def reference_digest(self, path):
+        """기준 이미지 (와 fiducial 정의) 내용 hash, 파일이 바뀌지 않았으면 다시 읽지 않음"""
+        label_file = os.path.splitext(path)[0] + '.json'
+        files = [f for f in (path, label_file) if os.path.exists(f)]
+        stamp = tuple((f, os.stat(f).st_mtime_ns, os.stat(f).st_size) for f in files)
+        if self._references.get(path, (None,))[0] != stamp:
+            self._references[path] = (stamp, '|'.join(file_digest(f) for f in files))
+
+        return self._references[path][1]
+
+    def get(self, key):
+        """
+        Keyword arguments:
+        :param key: 캐시 키
+        :return: 저장된 결과 dict (없으면 None)
+        """
+        entry_file = self._file(key)
+        try:
+            with np.load(entry_file) as data:
+                artifacts = {name: data[name] for name in data.files}
+        except (IOError, ValueError, EOFError):
+            return None
+        # Age counts from the last use, so boards that keep being re-analysed stay cached.
+        os.utime(entry_file)
+        artifacts['names'] = artifacts['names'].tolist()
+        artifacts['homography'] = artifacts['homography'] if artifacts['homography'].size else None
+
+        return artifacts
+
+    def put(self, key, crops, names, boxes, drawn_boxes, source_boxes, homography, shape, board_shape, warped):
+        """
+        Keyword arguments:
+        :param key: 캐시 키
+        :param crops: 결함 이미지 목록
+        :param names: 결함 이미지 이름 목록
+        :param boxes: 결함 이미지별 결함 영역 [x, y, w, h]
+        :param drawn_boxes: 보드 이미지에 표시한 결함 영역 (N, 4)
+        :param source_boxes: 테스트 이미지 좌표계의 결함 영역 (N, 4)
+        :param homography: 테스트 -> 기준 이미지 homography
+        :param shape: 테스트 이미지 크기
+        :param board_shape: 결함을 표시한 보드 이미지 크기
+        :param warped: 결함을 기준 이미지 좌표계로 옮긴 보드에 표시했는지
+        """
+        entry_file = self._file(key)
+        os.makedirs(os.path.dirname(entry_file), exist_ok=True)
+        crops = np.stack(crops) if len(crops) else np.zeros((0, 32, 32, 3), dtype=np.uint8)
+        tmp_file = entry_file + '.{}.tmp'.format(os.getpid())
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, crops=crops, names=np.array(names, dtype=str),
+                     boxes=np.array(boxes, dtype=np.int64).reshape(-1, 4),
+                     drawn_boxes=np.asarray(drawn_boxes, dtype=np.int64).reshape(-1, 4),
+                     source_boxes=np.asarray(source_boxes, dtype=np.int64).reshape(-1, 4),
+                     homography=np.zeros(0) if homography is None else np.asarray(homography),
+                     shape=np.array(shape[:2], dtype=np.int64), board_shape=np.array(board_shape[:2], dtype=np.int64),
+                     warped=np.array(warped))
+        os.replace(tmp_file, entry_file)
+
+    def evict(self):
+        """
+        오래된 항목 (max_age) 을 지우고, 전체 크기가 max_size 를 넘으면 가장 오래 쓰지 않은 항목부터 지움
+        저장 중인 임시 파일은 TMP_GRACE 가 지나기 전에는 지우지 않음 (다른 프로세스가 쓰고 있을 수 있음)
+        :return: 지운 항목 수
+        """
+        now = time.time()
+        entries = []
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                entry_file = os.path.join(root, name)
+                try:
+                    stat = os.stat(entry_file)
+                except OSError:
+                    continue
+                if name.endswith('.tmp'):
+                    # Another worker's put() may still be writing it; only crash leftovers are removed.
+                    if now - stat.st_mtime > TMP_GRACE:
+                        try:
+                            os.remove(entry_file)
+                        except OSError:
+                            pass
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry_file))
+
+        removed = 0
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, entry_file in sorted(entries):
+            if now - mtime <= self.max_age and total <= self.max_size:
+                break
+            try:
+                os.remove(entry_file)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+
+        return removed
+
+    def _file(self, key):
+        # Two-level fan-out keeps directories small on large runs.
+        return os.path.join(self.path, key[:2], key + '.npz')
@@ -0,0 +1,165 @@
+import concurrent.futures
+import argparse
+import numpy as np
+import cv2
+import os
+
+from detection_tool.transformation.crop_store import CropStore
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def random_affine(count, shape, rng, rotation_range=180, zoom_range=0.3):
+    """
+    회전 / 확대 affine 행렬을 한 번에 생성 (Keras ImageDataGenerator(rotation_range, zoom_range) 와 같은 분포)
+    행렬은 결과 좌표 -> 입력 좌표 (cv2.WARP_INVERSE_MAP) 이며, 이미지 중심을 기준으로 한다.
+    Keyword arguments:
+    :param count: 행렬 수
+    :param shape: 이미지 크기 (height, width)
+    :param rng: numpy Generator
+    :param rotation_range: 회전 범위 (도, -range ~ range)
+    :param zoom_range: 확대 범위 (1 - range ~ 1 + range, 가로 / 세로 따로)
+    :return: (count, 2, 3) float64
+    """
+    theta = np.deg2rad(rng.uniform(-rotation_range, rotation_range, count))
+    zx, zy = rng.uniform(1 - zoom_range, 1 + zoom_range, (2, count))
+    cos, sin = np.cos(theta), np.sin(theta)
+    cx, cy = (shape[1] - 1) / 2., (shape[0] - 1) / 2.
+
+    matrices = np.empty((count, 2, 3))
+    matrices[:, 0, 0], matrices[:, 0, 1] = cos * zx, -sin * zy
+    matrices[:, 1, 0], matrices[:, 1, 1] = sin * zx, cos * zy
+    # Keep the centre fixed: t = c - A c
+    matrices[:, 0, 2] = cx - matrices[:, 0, 0] * cx - matrices[:, 0, 1] * cy
+    matrices[:, 1, 2] = cy - matrices[:, 1, 0] * cx - matrices[:, 1, 1] * cy
+
+    return matrices
+
+
+def augment(image, count, seed=None, rotation_range=180, zoom_range=0.3):
+    """
+    이미지 하나에서 증강 이미지 count 개 생성
+    Keyword arguments:
+    :param image: 결함 이미지 uint8
+    :param count: 생성할 이미지 수
+    :param seed: 난수 seed (int 또는 np.random.SeedSequence, 같은 seed 는 같은 결과)
+    :param rotation_range: 회전 범위 (도)
+    :param zoom_range: 확대 범위
+    :return: (count, height, width[, channels]) uint8
+    """
+    rng = np.random.default_rng(seed)
+    height, width = image.shape[:2]
+    matrices = random_affine(count, (height, width), rng, rotation_range, zoom_range)
+    images = np.empty((count,) + image.shape, dtype=image.dtype)
+    for i in range(count):
+        # Same fill as the Keras generator (fill_mode='nearest').
+        cv2.warpAffine(image, matrices[i], (width, height), dst=images[i],
+                       flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+
+    return images
+
+
+def _augment_chunk(images, count, seeds, rotation_range, zoom_range):
+    # Runs in a worker process: one pickled round trip per chunk instead of per image.
+    return [augment(image, count, seed, rotation_range, zoom_range) for image, seed in zip(images, seeds)]
+
+
+class BatchAugmenter:
+    """
+    결함 이미지 여러 장을 프로세스 풀에서 증강해 CropStore 또는 이미지 파일로 저장하는 학습 데이터 생성기.
+    이미지마다 seed 를 SeedSequence 로 나눠 주므로 worker 수와 관계없이 같은 seed 는 같은 결과를 만든다.
+    """
+    def __init__(self, rotation_range=180, zoom_range=0.3, seed=None, workers=None, chunk_size=64):
+        """
+        Keyword arguments:
+        :param rotation_range: 회전 범위 (도)
+        :param zoom_range: 확대 범위
+        :param seed: 난수 seed (None 이면 매번 다름)
+        :param workers: 프로세스 수 (None 이면 CPU 수, 1 이면 현재 프로세스에서 실행)
+        :param chunk_size: worker 에 한 번에 넘길 이미지 수
+        """
+        self.rotation_range = rotation_range
+        self.zoom_range = zoom_range
+        self.seed = seed
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.chunk_size = chunk_size
+
+    def run(self, images, count):
+        """
+        Keyword arguments:
+        :param images: 결함 이미지 목록
+        :param count: 이미지당 생성할 수
+        :return: 입력 순서대로 (count, height, width, channels) 배열을 내놓는 iterator
+        """
+        seeds = np.random.SeedSequence(self.seed).spawn(len(images))
+        chunks = [(images[i:i + self.chunk_size], count, seeds[i:i + self.chunk_size],
+                   self.rotation_range, self.zoom_range) for i in range(0, len(images), self.chunk_size)]
+        if self.workers <= 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                yield from _augment_chunk(*chunk)
+            return
+
+        with concurrent.futures.ProcessPoolExecutor(self.workers) as pool:
+            # map keeps the input order, so the output does not depend on which worker finishes first.
+            for result in pool.map(_augment_chunk, *zip(*chunks)):
+                yield from result
+
+    def to_store(self, crop_store, images, names, count, category=None):
+        """
+        증강 이미지를 CropStore shard 에 저장
+        Keyword arguments:
+        :param crop_store: CropStore
+        :param images: 결함 이미지 목록
+        :param names: 결함 이미지 이름 목록
+        :param count: 이미지당 생성할 수
+        :param category: 저장할 분류 (str 또는 이미지별 목록)
+        :return ids: 저장된 이미지 id 목록
+        """
+        categories = category if isinstance(category, (list, tuple)) else [category] * len(images)
+        ids = []
+        for generated, name, category in zip(self.run(images, count), names, categories):
+            stem = os.path.splitext(name)[0]
+            for i, image in enumerate(generated):
+                ids.append(crop_store.append(image, '{}_{}.jpg'.format(stem, i), name,
+                                             (0, 0, image.shape[1], image.shape[0]), category))
+
+        return ids
+
+    def to_files(self, path, images, names, count):
+        """
+        증강 이미지를 <path>/<name>_<i>.jpg 로 저장 (Image.generator 와 같은 이름)
+        Keyword arguments:
+        :param path: 저장 위치
+        :param images: 결함 이미지 목록
+        :param names: 결함 이미지 이름 목록
+        :param count: 이미지당 생성할 수
+        :return: 저장한 파일 수
+        """
+        written = 0
+        for generated, name in zip(self.run(images, count), names):
+            for i, image in enumerate(generated):
+                cv2.imwrite(os.path.join(path, '{}_{}.jpg'.format(os.path.splitext(name)[0], i)), image)
+                written += 1
+
+        return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Augment labeled crops (<input>/<class>/<image>) into a crop store.')
+    parser.add_argument("-i", "--input", help="Labeled crop directory.", required=True)
+    parser.add_argument("-o", "--output", help="Output crop store path.", required=True)
+    parser.add_argument("-n", "--count", help="Images generated per crop.", type=int, default=10)
+    parser.add_argument("-s", "--seed", help="Random seed.", type=int, default=None)
+    parser.add_argument("-w", "--workers", help="Worker processes.", type=int, default=None)
+    args = parser.parse_args()
+
+    samples = [(category, name) for category in sorted(os.listdir(args.input))
+               if os.path.isdir(os.path.join(args.input, category))
+               for name in sorted(os.listdir(os.path.join(args.input, category)))
+               if name.lower().endswith(IMAGE_EXTENSIONS)]
+    crops = [cv2.imread(os.path.join(args.input, category, name)) for category, name in samples]
+    augmenter = BatchAugmenter(seed=args.seed, workers=args.workers)
+    with CropStore(args.output) as store:
+        ids = augmenter.to_store(store, crops, [name for _, name in samples], args.count,
+                                 [category for category, _ in samples])
+    print('Generated {} images from {} crops'.format(len(ids), len(samples)))
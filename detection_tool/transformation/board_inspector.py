@@ -0,0 +1,267 @@
+import collections
+import multiprocessing
+import numpy as np
+import cv2
+import os
+
+from detection_tool.transformation.image_function import Image
+from detection_tool.transformation.image_function import HISTORY_ALIGNMENTS
+from detection_tool.transformation.reference_store import ReferenceStore
+from detection_tool.transformation.crop_batch import CropBatch
+from detection_tool.transformation.manifest import reference_path
+from detection_tool.transformation.artifact_cache import ArtifactCache
+from detection_tool.transformation.artifact_cache import file_digest
+from detection_tool.transformation.artifact_cache import MAX_AGE
+from detection_tool.transformation.artifact_cache import MAX_SIZE
+from detection_tool.transformation.defect_labels import write_defect_labels
+
+# Set in each pool worker by init_worker.
+_inspector = None
+
+
+class BoardInspector:
+    """
+    보드 한 장 검사 (demo_xor 의 반복 본문).
+    직렬 실행과 worker 프로세스가 같은 코드를 쓴다. 정렬 이력 (reuse / auto / fiducial) 은 inspector 마다 따로 두므로,
+    이 정렬 방식에서는 보드 순서에 따라 결과가 달라진다 (pool_workers 참고).
+    """
+    def __init__(self, detection_info, path_info, writer=None, use_cache=True):
+        """
+        Keyword arguments:
+        :param detection_info: 설정 파일의 detection 항목
+        :param path_info: 설정 파일의 paths 항목
+        :param writer: 이미지를 백그라운드에서 저장할 ImageWriter (None 이면 바로 저장)
+        :param use_cache: artifact_cache_path 의 검사 결과 캐시 사용 (--no-cache 이면 False)
+        """
+        self.detection_info = detection_info
+        self.crop_path = os.path.abspath(path_info['crop_path'])
+        self.origin_path = os.path.abspath(path_info['origin_path'])
+        self.normal_path = os.path.abspath(path_info['xor_normal_path'])
+        self.result_path = os.path.abspath(path_info['xor_result_path'])
+        reference_cache_path = path_info.get('reference_cache_path')
+        label_path = path_info.get('label_path')
+        # Detection labels go to the run workspace; without one they are written next to the boards.
+        self.label_path = os.path.abspath(label_path) if label_path else None
+        self.writer = writer
+
+        # Golden images are shared by many boards, so their features are computed once.
+        self.reference_store = ReferenceStore(
+            cache_path=os.path.abspath(reference_cache_path) if reference_cache_path else None)
+        # One Image per inspector keeps the previous homography for the reuse/auto alignment modes.
+        self.image = Image(filter_chain=detection_info.get('filter_chain'))
+        self.cache = open_cache(detection_info, path_info) if use_cache else None
+
+    def inspect(self, test_path, defect, reference_file=None):
+        """
+        Keyword arguments:
+        :param test_path: 테스트 이미지 경로
+        :param defect: 테스트 이미지의 분류 폴더 이름
+        :param reference_file: 기준 이미지 경로 (None 이면 xor_normal_path 에서 이름으로 찾음)
+        :return: 보드 검사 결과 {board, class, crops (CropBatch), homography, stats, timings}
+        """
+        detection_info = self.detection_info
+        screening_info = detection_info.get('screening', {})
+        filename = os.path.basename(test_path)
+        crop_batch = CropBatch()
+
+        reference_file = reference_file or reference_path(test_path, self.normal_path)
+        if detection_info.get('annotation', 'image') == 'image':
+            os.makedirs(os.path.join(self.origin_path, defect), exist_ok=True)
+
+        key = None
+        if self.cache is not None:
+            # Under reuse / auto / fiducial the result also depends on the board aligned before this one.
+            alignment = detection_info.get('registration', {}).get('alignment', 'homography')
+            previous = self.image.last_homography if alignment in HISTORY_ALIGNMENTS else None
+            key = self.cache.key(test_path, file_digest(test_path), reference_file, detection_info, previous)
+            artifacts = self.cache.get(key)
+            if artifacts is not None:
+                return self.replay(artifacts, test_path, defect)
+
+        test_image = cv2.imread(test_path)
+        if test_image is None:
+            raise IOError('Failed to read test image: {}'.format(test_path))
+        reference = self.reference_store.get(reference_file)
+        try:
+            result = self.image.inspection(test_image, reference=reference,
+                                           annotation=detection_info.get('annotation', 'image'),
+                                           source_path=test_path,
+                                           label_path=self.label_path,
+                                           warp=detection_info.get('warp', 'image'),
+                                           registration_info=detection_info.get('registration', {}),
+                                           tile_size=detection_info.get('tile_size'),
+                                           tile_workers=detection_info.get('tile_workers'),
+                                           screening=screening_info if screening_info.get('enabled') else None,
+                                           morphology=detection_info.get('morphology', 'exact'),
+                                           extraction=detection_info.get('extraction'),
+                                           batch=crop_batch,
+                                           write_crops=detection_info.get('write_crops', True),
+                                           writer=self.writer,
+                                           size=32,
+                                           correction=20,
+                                           filename1=filename.split('.')[0],
+                                           filename2=filename,
+                                           crop_path=self.crop_path,
+                                           origin_path=os.path.join(self.origin_path, defect),
+                                           result_path=self.result_path)
+        except Exception:
+            # A failed board's partial counters and stage timings must not be added to the next board.
+            self.image.stats = collections.Counter()
+            self.image.filter_chain.reset()
+            raise
+        crop_batch.inspected.append(filename)
+
+        # Counters are handed back per board, so the caller can sum them whichever process ran the board.
+        stats, self.image.stats = self.image.stats, collections.Counter()
+        timings = self.image.filter_chain.timings.copy()
+        self.image.filter_chain.reset()
+        homography = self.image.last_homography
+        if key is not None:
+            self.cache.put(key, crop_batch.crops, crop_batch.names, crop_batch.boxes, self.image.last_boxes,
+                           self.image.last_source_boxes, homography, test_image.shape, result[0].shape,
+                           detection_info.get('warp', 'image') == 'image')
+
+        return {'board': filename, 'class': defect, 'crops': crop_batch,
+                'homography': None if homography is None else homography.tolist(), 'stats': stats,
+                'timings': timings}
+
+    def replay(self, artifacts, test_path, defect):
+        """
+        캐시된 검사 결과로 결함 이미지 / 보드 이미지 / label 을 다시 씀 (정합, 비교, 필터링은 건너뜀)
+        Keyword arguments:
+        :param artifacts: ArtifactCache.get 결과
+        :param test_path: 테스트 이미지 경로
+        :param defect: 테스트 이미지의 분류 폴더 이름
+        :return: 보드 검사 결과 (inspect 와 같음)
+        """
+        detection_info = self.detection_info
+        filename = os.path.basename(test_path)
+        count = len(artifacts['names'])
+        crop_batch = CropBatch(artifacts['crops'], artifacts['names'], [filename] * count, artifacts['boxes'],
+                               sources=[test_path] * count, inspected=[filename])
+        imwrite = self.writer.write if self.writer is not None else cv2.imwrite
+
+        if detection_info.get('write_crops', True):
+            for crop, name in zip(crop_batch.crops, crop_batch.names):
+                imwrite(os.path.join(self.crop_path, name), crop)
+        if detection_info.get('annotation', 'image') == 'label':
+            write_defect_labels(test_path, artifacts['source_boxes'], artifacts['shape'], label_path=self.label_path)
+        else:
+            board = cv2.imread(test_path)
+            if artifacts['warped']:
+                height, width = artifacts['board_shape']
+                board = cv2.warpPerspective(board, artifacts['homography'], (int(width), int(height)))
+            for x, y, w, h in artifacts['drawn_boxes']:
+                cv2.rectangle(board, (int(x), int(y)), (int(x + w), int(y + h)), (0, 0, 255), 2)
+            imwrite(os.path.join(self.origin_path, defect, filename), board)
+
+        homography = artifacts['homography']
+        # The next board starts from this homography, as if the board had been aligned again.
+        self.image.last_homography = homography
+
+        return {'board': filename, 'class': defect, 'crops': crop_batch,
+                'homography': None if homography is None else homography.tolist(),
+                'stats': collections.Counter(cached_boards=1),
+                'timings': np.zeros_like(self.image.filter_chain.timings)}
+
+
+def open_cache(detection_info, path_info):
+    """
+    설정의 검사 결과 캐시 (paths.artifact_cache_path 가 없거나 detection.cache.enabled 가 false 이면 None)
+    Keyword arguments:
+    :param detection_info: 설정 파일의 detection 항목
+    :param path_info: 설정 파일의 paths 항목
+    :return: ArtifactCache
+    """
+    cache_info = detection_info.get('cache', {})
+    cache_path = path_info.get('artifact_cache_path')
+    if not cache_path or not cache_info.get('enabled', True):
+        return None
+
+    return ArtifactCache(os.path.abspath(cache_path),
+                         max_size=cache_info.get('max_size_mb', MAX_SIZE // (1024 * 1024)) * 1024 * 1024,
+                         max_age=cache_info.get('max_age_days', MAX_AGE // (24 * 60 * 60)) * 24 * 60 * 60)
+
+
+def init_worker(detection_info, path_info, cv_threads, use_cache=True):
+    """
+    pool worker 초기화 (worker 마다 BoardInspector 하나)
+    Keyword arguments:
+    :param detection_info: 설정 파일의 detection 항목
+    :param path_info: 설정 파일의 paths 항목
+    :param cv_threads: worker 하나의 OpenCV 스레드 수
+    :param use_cache: 검사 결과 캐시 사용
+    """
+    global _inspector
+    # Every worker already has a core; letting each OpenCV call fan out as well only oversubscribes them.
+    cv2.setNumThreads(cv_threads)
+    _inspector = BoardInspector(detection_info, path_info, use_cache=use_cache)
+
+
+def inspect_task(inspector, task):
+    """
+    보드 한 장 검사. 읽을 수 없는 보드 / 기준 이미지는 알리고 빈 결과 (stats 의 failed_boards, error) 로 넘김
+    Keyword arguments:
+    :param inspector: BoardInspector
+    :param task: (테스트 이미지 경로, 분류 폴더 이름[, 기준 이미지 경로])
+    :return: 보드 검사 결과 (BoardInspector.inspect 참고)
+    """
+    try:
+        return inspector.inspect(*task)
+    except (IOError, ValueError, cv2.error) as e:
+        # One bad board must not end the run (or, in a pool, the whole imap).
+        print(' {} : {}, 건너뜀'.format(task[0], e))
+        return {'board': os.path.basename(task[0]), 'class': task[1], 'crops': CropBatch(), 'homography': None,
+                'stats': collections.Counter(failed_boards=1),
+                'timings': np.zeros_like(inspector.image.filter_chain.timings), 'error': str(e)}
+
+
+def inspect_board(task):
+    """pool worker 에서 보드 한 장 검사 (task: (테스트 이미지 경로, 분류 폴더 이름[, 기준 이미지 경로]))"""
+    return inspect_task(_inspector, task)
+
+
+def pool_workers(workers, detection_info):
+    """
+    실제로 쓸 worker 프로세스 수
+    직전 보드의 호모그래피에서 시작하는 정렬 방식은 worker 마다 직전 보드가 달라져 직렬 실행과 결과가 달라지므로 1 로 줄인다.
+    Keyword arguments:
+    :param workers: 요청한 worker 프로세스 수
+    :param detection_info: 설정 파일의 detection 항목
+    :return: worker 프로세스 수
+    """
+    if detection_info.get('registration', {}).get('alignment', 'homography') in HISTORY_ALIGNMENTS:
+        return 1
+
+    return workers
+
+
+def inspect_boards(tasks, detection_info, path_info, workers=1, cv_threads=None, writer=None, use_cache=True):
+    """
+    보드 여러 장 검사
+    Keyword arguments:
+    :param tasks: [(테스트 이미지 경로, 분류 폴더 이름[, 기준 이미지 경로]), ...] (iterator 면 읽는 대로 넘김)
+    :param detection_info: 설정 파일의 detection 항목
+    :param path_info: 설정 파일의 paths 항목
+    :param workers: worker 프로세스 수 (1 이면 현재 프로세스에서 실행, pool_workers 로 줄일 수 있음)
+    :param cv_threads: worker 하나의 OpenCV 스레드 수 (None 이면 CPU 수 / workers)
+    :param writer: 직렬 실행에서 쓸 ImageWriter
+    :param use_cache: 검사 결과 캐시 사용
+    :return: tasks 순서대로 보드 검사 결과를 내놓는 iterator
+    """
+    workers = pool_workers(workers, detection_info)
+    if workers <= 1:
+        inspector = BoardInspector(detection_info, path_info, writer=writer, use_cache=use_cache)
+        for task in tasks:
+            yield inspect_task(inspector, task)
+        return
+
+    if cv_threads is None:
+        cv_threads = max(1, (os.cpu_count() or 1) // workers)
+    # spawn: the caller runs inside a Qt thread, which fork does not copy safely.
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=init_worker,
+                      initargs=(detection_info, path_info, cv_threads, use_cache)) as pool:
+        # imap keeps the task order, so progress and the merged crop batch match serial mode.
+        for result in pool.imap(inspect_board, tasks):
+            yield result
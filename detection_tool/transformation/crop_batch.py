@@ -0,0 +1,103 @@
+import threading
+import numpy as np
+import os
+
+CROP_BATCH_FILE = 'crops.npz'
+
+
+class CropBatch:
+    """
+    image_defect 에서 잘라낸 결함 이미지와 출처 정보를 모아 분류기 입력으로 바로 넘기는 묶음.
+    이미지는 uint8 (BGR) 그대로 보관하므로 JPEG 압축 손실이 없다.
+    """
+    def __init__(self, crops=None, names=None, boards=None, boxes=None, ids=None, sources=None, inspected=None):
+        """
+        Keyword arguments:
+        :param crops: 결함 이미지 목록 (size, size, 3) uint8
+        :param names: 결함 이미지 이름 (기존 crop 파일 이름)
+        :param boards: 결함이 나온 테스트 이미지 파일 이름
+        :param boxes: 테스트 이미지 좌표계의 결함 영역 [x, y, w, h]
+        :param ids: CropStore 에 저장된 결함 이미지 id
+        :param sources: 결함이 나온 테스트 이미지 경로 (모르면 '')
+        :param inspected: 검사한 테스트 이미지 이름 (결함이 없는 보드 포함)
+        """
+        self.crops = list(crops) if crops is not None else []
+        self.names = list(names) if names is not None else []
+        self.boards = list(boards) if boards is not None else []
+        self.boxes = [tuple(int(v) for v in box) for box in boxes] if boxes is not None else []
+        self.ids = [int(i) for i in ids] if ids is not None else []
+        self.sources = list(sources) if sources is not None else [''] * len(self.crops)
+        self.inspected = list(inspected) if inspected is not None else []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.crops)
+
+    def append(self, crop, name, board, box, source=None):
+        """
+        Keyword arguments:
+        :param crop: 결함 이미지 (size, size, 3) uint8
+        :param name: 결함 이미지 이름
+        :param board: 테스트 이미지 파일 이름
+        :param box: 결함 영역 [x, y, w, h]
+        :param source: 테스트 이미지 경로
+        """
+        with self._lock:
+            self.crops.append(crop)
+            self.names.append(name)
+            self.boards.append(board)
+            self.boxes.append(tuple(int(v) for v in box))
+            self.sources.append(source or '')
+
+    def extend(self, other):
+        """다른 CropBatch 의 결함 이미지와 검사 기록을 이어 붙임 (worker 결과 합치기)"""
+        with self._lock:
+            self.crops.extend(other.crops)
+            self.names.extend(other.names)
+            self.boards.extend(other.boards)
+            self.boxes.extend(other.boxes)
+            self.sources.extend(other.sources)
+            self.inspected.extend(other.inspected)
+
+    def __getstate__(self):
+        # Batches come back from worker processes; the lock is not picklable.
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def batch(self):
+        """분류기 입력 (N, size, size, 3) float32, 0 ~ 1"""
+        if not self.crops:
+            return np.zeros((0, 32, 32, 3), dtype=np.float32)
+
+        return np.ascontiguousarray(np.stack(self.crops), dtype=np.float32) / np.float32(255.)
+
+    def save(self, path):
+        """
+        npz 로 저장 (다른 프로세스의 분류 단계로 넘김)
+        Keyword arguments:
+        :param path: 저장할 파일 경로
+        """
+        crops = np.stack(self.crops) if self.crops else np.zeros((0, 32, 32, 3), dtype=np.uint8)
+        # Readers only ever see a complete file.
+        tmp_file = path + '.{}.tmp'.format(os.getpid())
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, crops=crops, names=np.array(self.names, dtype=str), boards=np.array(self.boards, dtype=str),
+                     boxes=np.array(self.boxes, dtype=np.int64).reshape(-1, 4), ids=np.array(self.ids, dtype=np.int64),
+                     sources=np.array(self.sources, dtype=str), inspected=np.array(self.inspected, dtype=str))
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Keyword arguments:
+        :param path: save 로 저장한 파일 경로
+        :return: CropBatch
+        """
+        with np.load(path) as data:
+            optional = {key: data[key].tolist() for key in ('ids', 'sources', 'inspected') if key in data.files}
+            return cls(data['crops'], data['names'].tolist(), data['boards'].tolist(), data['boxes'], **optional)
@@ -0,0 +1,233 @@
+import collections
+import threading
+import argparse
+import json
+import numpy as np
+import cv2
+import os
+
+INDEX_FILE = 'index.jsonl'
+SHARD_SIZE = 64 * 1024 * 1024  # bytes per shard file
+SHARD_FORMAT = 'shard-{:05d}.bin'
+
+
+class CropStore:
+    """
+    결함 이미지를 낱개 JPEG 대신 큰 shard 파일에 이어 붙여 저장하는 저장소.
+    shard 에는 uint8 배열을 그대로 쓰고, index.jsonl 에 한 줄씩 (board, box, class, score) 를 기록한다.
+    분류 변경도 새 줄을 덧붙여 기록하므로 기존 파일은 수정하지 않는다. 쓰기는 한 프로세스에서만 한다.
+    """
+    def __init__(self, path, shard_size=SHARD_SIZE):
+        """
+        Keyword arguments:
+        :param path: 저장소 디렉터리
+        :param shard_size: shard 파일 하나의 최대 크기 (bytes)
+        """
+        self.path = path
+        self.shard_size = shard_size
+        self._records = collections.OrderedDict()
+        self._next_id = 0
+        self._shard = 0
+        self._shard_file = None
+        self._index_file = None
+        self._lock = threading.Lock()
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path, exist_ok=True)
+        self._load_index()
+
+    def __len__(self):
+        return len(self._records)
+
+    def append(self, crop, name, board, box, category=None, score=None):
+        """
+        결함 이미지 하나 추가
+        Keyword arguments:
+        :param crop: 결함 이미지 uint8
+        :param name: 결함 이미지 이름 (낱개 파일로 내보낼 때의 파일 이름)
+        :param board: 테스트 이미지 파일 이름
+        :param box: 테스트 이미지 좌표계의 결함 영역 [x, y, w, h]
+        :param category: 분류 결과
+        :param score: 분류 점수
+        :return: 결함 이미지 id
+        """
+        crop = np.ascontiguousarray(crop, dtype=np.uint8)
+        with self._lock:
+            shard_file = self._open_shard(crop.nbytes)
+            offset = shard_file.tell()
+            shard_file.write(crop.tobytes())
+            record = {'id': self._next_id, 'shard': self._shard, 'offset': offset, 'shape': list(crop.shape),
+                      'name': name, 'board': board, 'box': [int(v) for v in box], 'class': category,
+                      'score': None if score is None else float(score)}
+            self._records[record['id']] = record
+            self._next_id += 1
+            self._write_index(record)
+
+        return record['id']
+
+    def extend(self, crop_batch, categories=None, scores=None):
+        """
+        CropBatch 의 결함 이미지를 모두 추가
+        Keyword arguments:
+        :param crop_batch: CropBatch
+        :param categories: 분류 결과 목록
+        :param scores: 분류 점수 목록
+        :return ids: 결함 이미지 id 목록
+        """
+        categories = categories if categories is not None else [None] * len(crop_batch)
+        scores = scores if scores is not None else [None] * len(crop_batch)
+
+        return [self.append(crop, name, board, box, category, score)
+                for crop, name, board, box, category, score
+                in zip(crop_batch.crops, crop_batch.names, crop_batch.boards, crop_batch.boxes, categories, scores)]
+
+    def relabel(self, crop_id, category, score=None):
+        """
+        분류 결과 변경 (index 에 변경 기록을 덧붙임)
+        Keyword arguments:
+        :param crop_id: 결함 이미지 id
+        :param category: 분류 결과
+        :param score: 분류 점수
+        """
+        with self._lock:
+            update = {'id': crop_id, 'class': category, 'score': None if score is None else float(score)}
+            self._records[crop_id].update(update)
+            self._write_index(update)
+
+    def records(self, ids=None, category=None):
+        """
+        Keyword arguments:
+        :param ids: 결함 이미지 id 목록 (None 이면 전체)
+        :param category: 이 분류의 결함 이미지만
+        :return: 기록 목록 [{id, name, board, box, class, score, ...}, ...]
+        """
+        with self._lock:
+            records = [self._records[i] for i in ids] if ids is not None else list(self._records.values())
+
+        return [dict(record) for record in records if category is None or record['class'] == category]
+
+    def read(self, crop_id):
+        """결함 이미지 배열 하나 읽기"""
+        return self.read_many([crop_id])[0]
+
+    def read_many(self, ids):
+        """
+        결함 이미지 여러 개 읽기 (shard 마다 한 번씩 열고 offset 순서로 읽음)
+        Keyword arguments:
+        :param ids: 결함 이미지 id 목록
+        :return: 결함 이미지 목록
+        """
+        self.flush()
+        records = self.records(ids)
+        crops = [None] * len(records)
+        by_shard = collections.defaultdict(list)
+        for i, record in enumerate(records):
+            by_shard[record['shard']].append(i)
+
+        for shard, indices in by_shard.items():
+            with open(os.path.join(self.path, SHARD_FORMAT.format(shard)), 'rb') as f:
+                for i in sorted(indices, key=lambda i: records[i]['offset']):
+                    shape = records[i]['shape']
+                    f.seek(records[i]['offset'])
+                    crops[i] = np.frombuffer(f.read(int(np.prod(shape))), dtype=np.uint8).reshape(shape)
+
+        return crops
+
+    def export(self, path, ids=None, category=None):
+        """
+        낱개 이미지 파일로 내보내기 (<path>/<class>/<name>, 기존 labeled_path 구조)
+        Keyword arguments:
+        :param path: 내보낼 디렉터리
+        :param ids: 결함 이미지 id 목록 (None 이면 전체)
+        :param category: 이 분류의 결함 이미지만
+        :return: 내보낸 파일 수
+        """
+        records = self.records(ids, category)
+        crops = self.read_many([record['id'] for record in records])
+        for record, crop in zip(records, crops):
+            save_path = os.path.join(path, str(record['class']))
+            if not os.path.exists(save_path):
+                os.makedirs(save_path)
+            cv2.imwrite(os.path.join(save_path, record['name']), crop)
+
+        return len(records)
+
+    def flush(self):
+        with self._lock:
+            for f in (self._shard_file, self._index_file):
+                if f is not None:
+                    f.flush()
+
+    def close(self):
+        with self._lock:
+            for f in (self._shard_file, self._index_file):
+                if f is not None:
+                    f.close()
+            self._shard_file = None
+            self._index_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _load_index(self):
+        index_file = os.path.join(self.path, INDEX_FILE)
+        if not os.path.exists(index_file):
+            return
+
+        shard_sizes = {}
+        damaged = set()
+        with open(index_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by an interrupted run.
+                    continue
+                if 'shard' not in entry:
+                    if entry['id'] in self._records:
+                        self._records[entry['id']].update(entry)
+                    continue
+                shard = entry['shard']
+                if shard not in shard_sizes:
+                    shard_file = os.path.join(self.path, SHARD_FORMAT.format(shard))
+                    shard_sizes[shard] = os.path.getsize(shard_file) if os.path.exists(shard_file) else 0
+                # Crop bytes are written before their index line, so a record past the end of its shard is corrupt.
+                if entry['offset'] + int(np.prod(entry['shape'])) <= shard_sizes[shard]:
+                    self._records[entry['id']] = entry
+                else:
+                    damaged.add(shard)
+                self._next_id = max(self._next_id, entry['id'] + 1)
+                self._shard = max(self._shard, shard)
+        # Appending to a truncated shard would fill in the missing bytes and bring the dropped record back.
+        if self._shard in damaged:
+            self._shard += 1
+
+    def _open_shard(self, nbytes):
+        if self._shard_file is None:
+            self._shard_file = open(os.path.join(self.path, SHARD_FORMAT.format(self._shard)), 'ab')
+        if self._shard_file.tell() > 0 and self._shard_file.tell() + nbytes > self.shard_size:
+            self._shard_file.close()
+            self._shard += 1
+            self._shard_file = open(os.path.join(self.path, SHARD_FORMAT.format(self._shard)), 'ab')
+
+        return self._shard_file
+
+    def _write_index(self, entry):
+        if self._index_file is None:
+            self._index_file = open(os.path.join(self.path, INDEX_FILE), 'a', encoding='utf-8')
+        if self._shard_file is not None:
+            self._shard_file.flush()
+        self._index_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export a crop store to loose image files.')
+    parser.add_argument("-s", "--store", help="Crop store path.", required=True)
+    parser.add_argument("-o", "--output", help="Output directory (<output>/<class>/<name>).", required=True)
+    parser.add_argument("-c", "--category", help="Only export this class.", default=None)
+    args = parser.parse_args()
+
+    print('Exported {} crops'.format(CropStore(args.store).export(args.output, category=args.category)))
@@ -0,0 +1,103 @@
+import json
+import os
+
+LABEL_VERSION = '1.0.0'  # idc_tool LabelFile format version
+DEFECT_LABEL = 'defect'
+DEFECT_COLOR = [255, 0, 0, 255]
+
+
+def label_file_path(image_path, label_path=None):
+    """
+    LabelFile JSON 경로
+    Keyword arguments:
+    :param image_path: 테스트 이미지 경로
+    :param label_path: 실행 작업 공간의 label 폴더 (<label_path>/<분류 폴더>/<이름>.json,
+                       None 이면 이미지 옆 - idc_tool 이 이미지를 열 때 찾는 위치)
+    :return: JSON 경로
+    """
+    stem = os.path.splitext(image_path)[0]
+    if label_path is None:
+        return stem + '.json'
+
+    return os.path.join(label_path, os.path.basename(os.path.dirname(os.path.abspath(image_path))),
+                        os.path.basename(stem) + '.json')
+
+
+def find_label_file(image_path, label_path=None):
+    """보여줄 LabelFile JSON (실행 작업 공간에 검출 결과가 있으면 그것, 없으면 이미지 옆)"""
+    if label_path is not None:
+        path = label_file_path(image_path, label_path)
+        if os.path.isfile(path):
+            return path
+
+    return label_file_path(image_path)
+
+
+def write_defect_labels(image_path, boxes, image_shape, labels=None, label_path=None):
+    """
+    검출된 결함 영역을 LabelFile JSON 의 사각형 shape 로 저장
+    이미 있는 JSON 의 사람이 그린 shape 는 그대로 두고, 이전 검출 결과(flags.detected) 만 바꾼다.
+    label_path 에 처음 쓸 때는 이미지 옆 JSON 의 shape 에서 시작하고, 이미지 옆 JSON 은 바꾸지 않는다.
+    Keyword arguments:
+    :param image_path: 테스트 이미지 경로
+    :param boxes: 테스트 이미지 좌표계의 결함 영역 (N, 4) [x, y, w, h]
+    :param image_shape: 테스트 이미지 크기
+    :param labels: 결함별 분류 (None 이면 모두 'defect')
+    :param label_path: 실행 작업 공간의 label 폴더 (None 이면 이미지 옆에 저장)
+    :return: JSON 경로
+    """
+    path = label_file_path(image_path, label_path)
+    data = _load(path)
+    if data is None and label_path is not None:
+        data = _load(label_file_path(image_path))
+    data = data or dict(version=LABEL_VERSION, flags={}, shapes=[], lineColor=None, fillColor=None,
+                        imagePath=os.path.basename(image_path), imageData=None)
+    if label_path is not None:
+        # Away from the image the viewer resolves imagePath against the JSON folder; an absolute path survives publish.
+        data['imagePath'] = os.path.abspath(image_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    labels = labels if labels is not None else [DEFECT_LABEL] * len(boxes)
+
+    shapes = [shape for shape in data['shapes'] if not shape.get('flags', {}).get('detected')]
+    for (x, y, w, h), label in zip(boxes, labels):
+        shapes.append(dict(label=label, points=[[int(x), int(y)], [int(x + w), int(y + h)]],
+                           line_color=DEFECT_COLOR, fill_color=None, shape_type='rectangle',
+                           flags={'detected': True}))
+    data.update(shapes=shapes, imageHeight=int(image_shape[0]), imageWidth=int(image_shape[1]))
+    _save(path, data)
+
+    return path
+
+
+def relabel_defects(image_path, labels, label_path=None):
+    """
+    검출 shape 의 분류를 순서대로 바꿈 (분류 단계 결과 반영)
+    Keyword arguments:
+    :param image_path: 테스트 이미지 경로
+    :param labels: 검출 shape 순서대로의 분류
+    :param label_path: 실행 작업 공간의 label 폴더 (write_defect_labels 와 같은 값)
+    """
+    path = label_file_path(image_path, label_path)
+    data = _load(path)
+    if data is None:
+        return
+
+    detected = [shape for shape in data['shapes'] if shape.get('flags', {}).get('detected')]
+    for shape, label in zip(detected, labels):
+        shape['label'] = label
+    _save(path, data)
+
+
+def _load(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save(path, data):
+    # The viewer may open the file at any time, so it only ever sees a complete JSON.
+    tmp_file = path + '.{}.tmp'.format(os.getpid())
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, path)
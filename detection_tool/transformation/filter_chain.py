@@ -0,0 +1,205 @@
+import collections
+import functools
+import threading
+import time
+import numpy as np
+import cv2
+
+SHAPES = {
+    'rect': cv2.MORPH_RECT,
+    'ellipse': cv2.MORPH_ELLIPSE,
+    'cross': cv2.MORPH_CROSS,
+}
+OPERATIONS = {
+    'erode': cv2.MORPH_ERODE,
+    'dilate': cv2.MORPH_DILATE,
+    'open': cv2.MORPH_OPEN,
+    'close': cv2.MORPH_CLOSE,
+}
+# image_filter stages as originally hard-coded in Image.image_filter
+DEFAULT_FILTER_CHAIN = [
+    dict(op='median', ksize=5),
+    dict(op='close', shape='rect', size=15),
+    dict(op='open', shape='rect', size=3),
+    dict(op='median', ksize=5),
+    dict(op='close', shape='ellipse', size=29),
+    dict(op='open', shape='rect', size=3),
+    dict(op='open', shape='rect', size=1),
+]
+
+
+@functools.lru_cache(maxsize=None)
+def ellipse_decomposition(size):
+    """
+    타원 구조 요소를 사각형 + 십자 반복으로 분해 (빠른 형태학 연산용)
+    사각형(2a+1) 과 3x3 십자 b 회의 Minkowski 합은 반경 a+b 인 팔각형이 되며, 타원과 가장 비슷한 a 를 고른다.
+    Keyword arguments:
+    :param size: 타원 구조 요소 크기 (홀수)
+    :return rect, iterations: 사각형 구조 요소, 십자 반복 횟수
+    """
+    radius = size // 2
+    ellipse = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+    cross = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+    point = np.pad(np.ones((1, 1), dtype=np.uint8), radius)
+
+    best = None
+    for a in range(radius + 1):
+        rect = cv2.getStructuringElement(cv2.MORPH_RECT, (2 * a + 1, 2 * a + 1))
+        kernel = cv2.dilate(point, cross, iterations=radius - a) if a < radius else point
+        error = np.count_nonzero(cv2.dilate(kernel, rect) != ellipse)
+        if best is None or error < best[0]:
+            best = (error, rect, radius - a)
+
+    return best[1], best[2]
+
+
+class FilterStage:
+    """구조 요소를 미리 만들어 둔 필터 단계 하나 (median 또는 형태학 연산)."""
+    def __init__(self, op, ksize=None, shape='rect', size=None):
+        """
+        Keyword arguments:
+        :param op: median, erode, dilate, open, close
+        :param ksize: median 커널 크기 (홀수)
+        :param shape: 구조 요소 모양 (rect, ellipse, cross)
+        :param size: 구조 요소 크기
+        """
+        if op != 'median' and op not in OPERATIONS:
+            raise ValueError('Unknown filter operation: {}'.format(op))
+        if op != 'median' and shape not in SHAPES:
+            raise ValueError('Unknown structuring element: {}'.format(shape))
+
+        self.op = op
+        self.ksize = ksize
+        self.shape = shape
+        self.size = size
+        self.kernel = None
+        self.decomposition = None
+        if op == 'median':
+            self.name = 'median {}'.format(ksize)
+        else:
+            self.name = '{} {} {}'.format(op, shape, size)
+            self.kernel = cv2.getStructuringElement(SHAPES[shape], (size, size))
+            if shape == 'ellipse' and size > 3:
+                self.decomposition = ellipse_decomposition(size)
+
+    @property
+    def noop(self):
+        """1x1 구조 요소나 크기 1 median 은 이미지를 바꾸지 않음"""
+        return (self.ksize if self.op == 'median' else self.size) <= 1
+
+    @property
+    def radius(self):
+        """결과 한 pixel 이 의존하는 입력 반경 (타일 겹침 계산용)"""
+        if self.op == 'median':
+            return self.ksize // 2
+        radius = self.size // 2
+
+        return 2 * radius if self.op in ('open', 'close') else radius
+
+    def __eq__(self, other):
+        return isinstance(other, FilterStage) and self.name == other.name
+
+    def __call__(self, src, dst=None, morphology='exact'):
+        """
+        Keyword arguments:
+        :param src: 입력 이미지
+        :param dst: 결과를 쓸 배열
+        :param morphology: exact, fast (타원 구조 요소를 사각형 + 십자 반복으로 근사)
+        :return: 필터링 된 이미지
+        """
+        if self.op == 'median':
+            return cv2.medianBlur(src, self.ksize, dst=dst)
+        if morphology == 'exact' or self.decomposition is None:
+            return cv2.morphologyEx(src, OPERATIONS[self.op], self.kernel, dst=dst)
+        if morphology != 'fast':
+            raise ValueError('Unknown morphology: {}'.format(morphology))
+
+        # Rect passes are separable and tiny crosses are cheap, unlike a large non-separable ellipse.
+        if self.op == 'close':
+            return self.erode(self.dilate(src), dst)
+        if self.op == 'open':
+            return self.dilate(self.erode(src), dst)
+
+        return getattr(self, self.op)(src, dst)
+
+    def dilate(self, src, dst=None):
+        rect, iterations = self.decomposition
+        cross = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+
+        return cv2.dilate(cv2.dilate(src, rect), cross, dst=dst, iterations=iterations)
+
+    def erode(self, src, dst=None):
+        rect, iterations = self.decomposition
+        cross = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+
+        return cv2.erode(cv2.erode(src, cross, iterations=iterations), rect, dst=dst)
+
+
+class FilterChain:
+    """
+    설정 파일에 선언된 필터 단계 목록.
+    구조 요소는 한 번만 만들고, 결과를 바꾸지 않는 단계는 제거하며, 단계별 소요 시간을 기록한다.
+    """
+    def __init__(self, stages=None):
+        """
+        Keyword arguments:
+        :param stages: 단계 정의 목록 [{op, ksize | shape, size}, ...] (None 이면 DEFAULT_FILTER_CHAIN)
+        """
+        self.stages = []
+        for spec in (stages if stages is not None else DEFAULT_FILTER_CHAIN):
+            stage = FilterStage(**spec)
+            # Opening and closing are idempotent, so a repeat of the previous stage changes nothing.
+            if stage.noop or (self.stages and stage == self.stages[-1] and stage.op in ('open', 'close')):
+                continue
+            self.stages.append(stage)
+        self.timings = np.zeros(len(self.stages))
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def halo(self):
+        """모든 단계의 누적 반경"""
+        return sum(stage.radius for stage in self.stages)
+
+    def run(self, image, buffer1=None, buffer2=None, dst=None, morphology='exact'):
+        """
+        단계를 차례로 적용 (중간 결과는 두 버퍼를 번갈아 사용)
+        Keyword arguments:
+        :param image: XOR 이미지
+        :param buffer1: 중간 결과 버퍼
+        :param buffer2: 중간 결과 버퍼
+        :param dst: 결과를 쓸 배열
+        :param morphology: exact, fast
+        :return: 필터링 된 이미지
+        """
+        if not self.stages:
+            if dst is None:
+                return image.copy()
+            np.copyto(dst, image)
+            return dst
+
+        timings = np.zeros(len(self.stages))
+        buffers = (buffer1, buffer2)
+        result = image
+        for i, stage in enumerate(self.stages):
+            s = time.perf_counter()
+            result = stage(result, dst if i == len(self.stages) - 1 else buffers[i % 2], morphology)
+            timings[i] = time.perf_counter() - s
+
+        # Tiles call run concurrently, so the totals are updated under a lock.
+        with self._lock:
+            self.timings += timings
+            self.calls += 1
+
+        return result
+
+    def report(self):
+        """단계별 (이름, 누적 소요 시간 ms)"""
+        with self._lock:
+            return collections.OrderedDict(('{}. {}'.format(i + 1, stage.name), float(ms * 1000))
+                                           for i, (stage, ms) in enumerate(zip(self.stages, self.timings)))
+
+    def reset(self):
+        with self._lock:
+            self.timings[:] = 0
+            self.calls = 0
@@ -0,0 +1,183 @@
+import collections
+import threading
+import time
+import os
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    # Polling alone still works; watchdog (inotify on Linux) only shortens the wait for new files.
+    Observer = None
+    FileSystemEventHandler = object
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+# End-of-image markers: a writer that stalls longer than settle still is not read half-written.
+TRAILERS = {'.jpg': b'\xff\xd9', '.jpeg': b'\xff\xd9', '.png': b'IEND\xaeB`\x82'}
+TRAILER_WINDOW = 32  # bytes; some cameras pad after the marker
+
+
+def is_complete(path):
+    """파일 끝에 JPEG / PNG 종료 표시가 있는지 (다른 형식은 항상 True)"""
+    trailer = TRAILERS.get(os.path.splitext(path)[1].lower())
+    if trailer is None:
+        return True
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - TRAILER_WINDOW))
+        return trailer in f.read()
+
+
+class _EventHandler(FileSystemEventHandler):
+    """watchdog 이벤트를 FolderWatcher 에 넘김"""
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event):
+        self.watcher.notify(event.src_path)
+
+    def on_modified(self, event):
+        self.watcher.notify(event.src_path)
+
+    def on_moved(self, event):
+        self.watcher.notify(event.dest_path)
+
+
+class FolderWatcher:
+    """
+    폴더에 새로 들어온 이미지 파일을 찾는 감시기.
+    카메라가 아직 쓰고 있는 파일을 읽지 않도록, 두 번 연속 같은 크기 / 수정 시각이고 마지막 수정 후 settle 초가 지났으며
+    이미지 종료 표시까지 쓰인 파일만 내놓는다.
+    watchdog 이 있으면 파일 이벤트로 바로 깨어나고, 없으면 interval 마다 폴더를 다시 읽는다.
+    처리에 실패한 파일은 retry 후 retry_delay, 2 배, 4 배 ... 초가 지나야 다시 내놓는다.
+    """
+    def __init__(self, path, settle=0.5, interval=0.2, rescan=5., recursive=True, events=True,
+                 extensions=IMAGE_EXTENSIONS, retry_delay=10.):
+        """
+        Keyword arguments:
+        :param path: 감시할 폴더
+        :param settle: 마지막 수정 후 기다릴 시간 (초)
+        :param interval: 쓰는 중인 파일을 다시 확인하는 간격 (초, 이벤트가 없으면 폴더를 다시 읽는 간격)
+        :param rescan: 이벤트를 쓸 때 놓친 파일을 찾으려고 폴더 전체를 다시 읽는 간격 (초)
+        :param recursive: 하위 폴더 (분류 폴더) 포함
+        :param events: watchdog 이 설치되어 있으면 파일 이벤트 사용
+        :param extensions: 감시할 확장자
+        :param retry_delay: 첫 재시도까지 기다릴 시간 (초, 실패할 때마다 2 배)
+        """
+        self.path = os.path.abspath(path)
+        self.settle = settle
+        self.interval = interval
+        self.rescan = rescan
+        self.recursive = recursive
+        self.extensions = extensions
+        self.retry_delay = retry_delay
+        self.done = set()
+        self.failures = collections.Counter()
+        self._retry_at = {}
+        self._pending = {}
+        self._events = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._last_scan = None
+        self._observer = None
+
+        if events and Observer is not None:
+            self._observer = Observer()
+            self._observer.schedule(_EventHandler(self), self.path, recursive=recursive)
+            self._observer.start()
+
+    @property
+    def uses_events(self):
+        return self._observer is not None
+
+    def notify(self, path):
+        """파일 이벤트 (watchdog 스레드에서 호출)"""
+        if path.lower().endswith(self.extensions):
+            with self._lock:
+                self._events.add(os.path.abspath(path))
+            self._wake.set()
+
+    def list_files(self):
+        """폴더의 이미지 파일 (이미 처리한 파일 제외)"""
+        files = []
+        for root, dirs, names in os.walk(self.path):
+            if not self.recursive:
+                dirs[:] = []
+            files.extend(os.path.join(root, name) for name in names if name.lower().endswith(self.extensions))
+
+        return [f for f in files if f not in self.done]
+
+    def poll(self):
+        """
+        다 쓰인 새 파일 목록 (한 파일은 한 번만 나옴)
+        :return: 파일 경로 목록 (이름 순)
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates, self._events = self._events, set()
+        if self._observer is None or self._last_scan is None or now - self._last_scan >= self.rescan:
+            candidates.update(self.list_files())
+            self._last_scan = now
+        for path, retry_at in list(self._retry_at.items()):
+            if retry_at <= now:
+                candidates.add(path)
+                del self._retry_at[path]
+        for path in candidates:
+            if path not in self.done and path not in self._retry_at:
+                self._pending.setdefault(path, None)
+
+        ready = []
+        for path, previous in list(self._pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Moved away or deleted before it was finished.
+                del self._pending[path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            self._pending[path] = current
+            if current == previous and stat.st_size and time.time() - stat.st_mtime >= self.settle \
+                    and is_complete(path):
+                ready.append(path)
+                self.done.add(path)
+                del self._pending[path]
+
+        return sorted(ready)
+
+    def retry(self, path):
+        """
+        처리에 실패한 파일을 나중에 다시 내놓음
+        Keyword arguments:
+        :param path: 파일 경로
+        :return: 다시 내놓을 때까지의 시간 (초)
+        """
+        self.failures[path] += 1
+        delay = self.retry_delay * 2 ** (self.failures[path] - 1)
+        self.done.discard(path)
+        self._retry_at[path] = time.monotonic() + delay
+
+        return delay
+
+    def wait(self):
+        """다음 poll 까지 대기 (이벤트가 오면 바로 돌아옴)"""
+        if self._observer is not None and not self._pending:
+            timeout = self.rescan
+        else:
+            timeout = self.interval
+        if self._retry_at:
+            timeout = max(0., min(timeout, min(self._retry_at.values()) - time.monotonic()))
+        self._wake.wait(timeout)
+        self._wake.clear()
+
+    def close(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,123 +1,1097 @@
+import collections
+import concurrent.futures
+import functools
 import numpy as np
 import cv2
 import os
 import imutils
+import scipy.fft
 import scipy.fftpack
+import scipy.sparse
+import scipy.sparse.csgraph
+
+from detection_tool.transformation.filter_chain import FilterChain
+from detection_tool.transformation.defect_labels import write_defect_labels
+from detection_tool.transformation.augmentation import augment
+
+ORB_FEATURES = 5000
+BLUR_KSIZE = (5, 5)
+THRESH_BLOCK_SIZE = 5
+THRESH_C = 2
+
+ESTIMATORS = {
+    'ransac': cv2.RANSAC,
+    'rho': cv2.RHO,
+    'usac': getattr(cv2, 'USAC_DEFAULT', cv2.RANSAC),  # USAC needs OpenCV >= 4.5
+}
+FLANN_LSH_PARAMS = dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1)  # FLANN_INDEX_LSH
+FEATURE_AREA = 1000  # pixels per ORB feature in pyramid mode
+MIN_FEATURES = 500
+COMPARISON_HALO = 2 + 2  # Gaussian blur + adaptive threshold block radius
+MERGE_CHUNK = 1024  # rows of the pairwise box matrix computed at once
+HOMOMORPHIC_SIGMA = 10  # Gaussian low pass sigma in frequency bins of the (2H+1)x(2W+1) grid
+# Alignment modes that start from the previous board's homography, so the result depends on board order.
+HISTORY_ALIGNMENTS = ('auto', 'fiducial', 'reuse')
+
+
+def feature_budget(shape):
+    """이미지 크기에 비례하는 ORB 특징점 수"""
+    return int(np.clip(shape[0] * shape[1] / FEATURE_AREA, MIN_FEATURES, ORB_FEATURES))
+
+
+def run_regions(func, shape, dst, regions, halo, workers=None):
+    """
+    영역마다 겹침(halo)을 붙여 스레드 풀에서 처리하고 영역 안쪽 결과를 dst 에 씀
+    Keyword arguments:
+    :param func: 영역 (y 슬라이스, x 슬라이스) 을 받아 그 영역의 결과를 반환하는 함수
+    :param shape: 이미지 크기
+    :param dst: 결과를 쓸 배열
+    :param regions: 처리할 영역 목록 [(y, x, h, w), ...]
+    :param halo: 겹침 (처리 단계들의 누적 반경 이상이어야 결과가 한 번에 처리한 것과 같음)
+    :param workers: 스레드 수 (None 이면 CPU 수)
+    :return dst:
+    """
+    height, width = shape[:2]
+
+    def process(region):
+        y, x, h, w = region
+        y0, x0 = max(0, y - halo), max(0, x - halo)
+        y1, x1 = min(height, y + h + halo), min(width, x + w + halo)
+        out = func(slice(y0, y1), slice(x0, x1))
+        dst[y:y + h, x:x + w] = out[y - y0:y - y0 + h, x - x0:x - x0 + w]
+
+    # OpenCV releases the GIL, so threads run the regions in parallel without copying the image.
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        list(pool.map(process, regions))
+
+    return dst
+
+
+def run_tiled(func, shape, dst, tile_size, halo, workers=None):
+    """
+    큰 이미지를 겹치는 타일로 나눠 스레드 풀에서 처리하고 결과를 dst 에 합침
+    Keyword arguments:
+    :param func: 타일 영역 (y 슬라이스, x 슬라이스) 을 받아 그 영역의 결과를 반환하는 함수
+    :param shape: 이미지 크기
+    :param dst: 결과를 쓸 배열
+    :param tile_size: 타일 한 변의 길이 (겹침 제외)
+    :param halo: 타일 사이 겹침
+    :param workers: 스레드 수 (None 이면 CPU 수)
+    :return dst:
+    """
+    height, width = shape[:2]
+    regions = [(y, x, min(tile_size, height - y), min(tile_size, width - x))
+               for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+
+    return run_regions(func, shape, dst, regions, halo, workers)
+
+
+@functools.lru_cache(maxsize=16)
+def homomorphic_mask(rows, cols, gamma_1, gamma_2, sigma=HOMOMORPHIC_SIGMA):
+    """
+    동형 필터 (gamma_1 * 저주파 + gamma_2 * 고주파) 의 rfft2 주파수 응답 (크기별로 한 번만 생성)
+    기존 구현은 (2H+1)x(2W+1) 격자에서 중심이 1 bin 어긋난 Gaussian 을 곱하고 실수부만 취하므로,
+    같은 결과를 주는 대칭 필터 0.5 * (G(k - 1) + G(k + 1)) 를 최적 DFT 크기 격자에 맞춰 계산한다.
+    Keyword arguments:
+    :param rows: 이미지 높이
+    :param cols: 이미지 너비
+    :param gamma_1: 저주파 배율
+    :param gamma_2: 고주파 배율
+    :param sigma: 저주파 Gaussian sigma
+    :return mask, size: (M, N // 2 + 1) float32, DFT 크기 (M, N)
+    """
+    size = (cv2.getOptimalDFTSize(2 * rows + 1), cv2.getOptimalDFTSize(2 * cols + 1))
+    # Frequencies in bins of the original (2H+1)x(2W+1) grid, so sigma keeps its meaning at any padding.
+    fy = scipy.fft.fftfreq(size[0]) * (2 * rows + 1)
+    fx = scipy.fft.rfftfreq(size[1]) * (2 * cols + 1)
+
+    def gaussian(f, offset):
+        return np.exp(-(f - offset) ** 2 / (2. * sigma * sigma))
+
+    low = 0.5 * (np.outer(gaussian(fy, 1), gaussian(fx, 1)) + np.outer(gaussian(fy, -1), gaussian(fx, -1)))
+    mask = (gamma_2 + (gamma_1 - gamma_2) * low).astype(np.float32)
+    mask.flags.writeable = False
+
+    return mask, size
+
+
+def imclearborder(imgBW, radius):
+    """경계 근처에 닿은 contour 를 지움 (contour 점마다 확인하는 기존 구현, clear_border 참고)"""
+    # Given a black and white image, first find all of its contours
+    imgBWcopy = imgBW.copy()
+    contours, hierarchy = cv2.findContours(imgBWcopy.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+    # Get dimensions of image
+    imgRows = imgBW.shape[0]
+    imgCols = imgBW.shape[1]
+
+    contourList = []  # ID list of contours that touch the border
+
+    # For each contour...
+    for idx in np.arange(len(contours)):
+        # Get the i'th contour
+        cnt = contours[idx]
+
+        # Look at each point in the contour
+        for pt in cnt:
+            rowCnt = pt[0][1]
+            colCnt = pt[0][0]
+
+            # If this is within the radius of the border
+            # this contour goes bye bye!
+            check1 = (rowCnt >= 0 and rowCnt < radius) or (rowCnt >= imgRows - 1 - radius and rowCnt < imgRows)
+            check2 = (colCnt >= 0 and colCnt < radius) or (colCnt >= imgCols - 1 - radius and colCnt < imgCols)
+
+            if check1 or check2:
+                contourList.append(idx)
+                break
+
+    for idx in contourList:
+        cv2.drawContours(imgBWcopy, contours, idx, (0, 0, 0), -1)
+
+    return imgBWcopy
+
+
+def bwareaopen(imgBW, areaPixels):
+    """contourArea 가 areaPixels 이하인 contour 를 지움 (기존 구현, area_open 참고)"""
+    # Given a black and white image, first find all of its contours
+    imgBWcopy = imgBW.copy()
+    contours, hierarchy = cv2.findContours(imgBWcopy.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+    # For each contour, determine its total occupying area
+    for idx in np.arange(len(contours)):
+        area = cv2.contourArea(contours[idx])
+        if (area >= 0 and area <= areaPixels):
+            cv2.drawContours(imgBWcopy, contours, idx, (0, 0, 0), -1)
+
+    return imgBWcopy
+
+
+def remove_components(binary, radius=None, area=None):
+    """
+    경계에 닿은 영역과 작은 영역을 한 번에 제거 (imclearborder -> bwareaopen 과 결과가 같음)
+    contour 를 한 번만 찾고, 경계 확인 / 넓이 계산을 모든 contour 에 대해 배열 연산으로 한 뒤 지울 contour 만 채운다.
+    지울 contour 안에 들어 있는 contour 는 바깥 contour 를 채울 때 같이 지워지므로 그리지 않는다.
+    Keyword arguments:
+    :param binary: 이진 이미지 uint8 (0 / 255)
+    :param radius: 경계 폭 (pixel, None 이면 경계 영역을 지우지 않음)
+    :param area: 제거할 최대 contour 넓이 (None 이면 작은 영역을 지우지 않음)
+    :return: 이진 이미지 uint8
+    """
+    rows, cols = binary.shape[:2]
+    result = binary.copy()
+    # RETR_TREE finds the same contours as RETR_LIST, plus the nesting needed to skip enclosed ones.
+    contours, hierarchy = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return result
+
+    remove = np.zeros(len(contours), dtype=bool)
+    if radius is not None:
+        starts = np.cumsum([0] + [len(contour) for contour in contours[:-1]])
+        x, y = np.concatenate(contours).reshape(-1, 2).T
+        # Same border band as imclearborder: [0, radius) and [size - 1 - radius, size)
+        near = (y < radius) | (y >= rows - 1 - radius) | (x < radius) | (x >= cols - 1 - radius)
+        remove |= np.logical_or.reduceat(near, starts)
+    if area is not None:
+        # Polygon area, as in bwareaopen; a hole contour also clears the hole's rim.
+        remove |= np.array([cv2.contourArea(contour) for contour in contours]) <= area
+
+    # Clearing a region never changes another region's contours, so both steps share one contour search.
+    parent = hierarchy[0][:, 3]
+    enclosed = np.zeros(len(contours), dtype=bool)
+    ancestor = parent.copy()
+    while (ancestor >= 0).any():
+        valid = ancestor >= 0
+        enclosed[valid] |= remove[ancestor[valid]]
+        ancestor[valid] = parent[ancestor[valid]]
+    cv2.drawContours(result, [contours[i] for i in np.flatnonzero(remove & ~enclosed)], -1, 0, -1)
+
+    return result
+
+
+def clear_border(binary, radius):
+    """경계 근처에 닿은 영역 제거 (imclearborder 와 결과가 같은 배열 연산 버전)"""
+    return remove_components(binary, radius=radius)
+
+
+def area_open(binary, area):
+    """contour 넓이가 area 이하인 영역 제거 (bwareaopen 과 결과가 같은 배열 연산 버전)"""
+    return remove_components(binary, area=area)
+
+
+def subpixel_peak(values, i):
+    """1차원 상관 값에서 포물선 보간으로 구한 최대값 위치의 소수부"""
+    if i <= 0 or i >= len(values) - 1:
+        return 0.
+    left, center, right = float(values[i - 1]), float(values[i]), float(values[i + 1])
+    denominator = left - 2 * center + right
+
+    return 0. if denominator == 0 else 0.5 * (left - right) / denominator
+
+
+class BufferPool:
+    """같은 크기의 보드가 반복될 때 OpenCV dst= 출력 버퍼를 다시 쓰기 위한 저장소."""
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name, shape, dtype=np.uint8):
+        """
+        이름별 버퍼 반환 (크기나 형식이 다르면 새로 할당)
+        Keyword arguments:
+        :param name: 버퍼 이름
+        :param shape: 배열 크기
+        :param dtype: 배열 형식
+        :return: 내용이 정해지지 않은 배열
+        """
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
 
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
+        return buffer
+
+
+class ImageContext:
+    """
+    한 이미지에서 파생되는 표현(흑백, 평활화, 블러, 이진)을 한 번씩만 계산해 단계 간에 공유.
+    buffers 를 주면 결과를 그 버퍼에 쓰므로, 같은 버퍼 저장소로 다음 이미지를 처리하기 전까지만 유효하다.
+    """
+    def __init__(self, image, buffers=None, name='image'):
+        """
+        Keyword arguments:
+        :param image: 컬러 또는 흑백 이미지
+        :param buffers: 출력 버퍼 저장소 (None 이면 매번 새로 할당)
+        :param name: 버퍼 이름 접두어
+        """
+        self.image = image
+        self.buffers = buffers
+        self.name = name
+        self._cache = {}
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    def _dst(self, form):
+        if self.buffers is None:
+            return None
+        return self.buffers.get(self.name + '.' + form, self.image.shape[:2])
+
+    def gray(self):
+        if 'gray' not in self._cache:
+            if len(self.image.shape) == 3:
+                self._cache['gray'] = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY, dst=self._dst('gray'))
+            else:
+                self._cache['gray'] = self.image
+        return self._cache['gray']
+
+    def equalized(self):
+        if 'equalized' not in self._cache:
+            self._cache['equalized'] = cv2.equalizeHist(self.gray(), dst=self._dst('equalized'))
+        return self._cache['equalized']
+
+    def blurred(self):
+        if 'blurred' not in self._cache:
+            self._cache['blurred'] = cv2.GaussianBlur(self.equalized(), BLUR_KSIZE, 0, dst=self._dst('blurred'))
+        return self._cache['blurred']
+
+    def binary(self):
+        if 'binary' not in self._cache:
+            self._cache['binary'] = cv2.adaptiveThreshold(self.blurred(), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                                          cv2.THRESH_BINARY, THRESH_BLOCK_SIZE, THRESH_C,
+                                                          dst=self._dst('binary'))
+        return self._cache['binary']
 
 
 class Image:
 
-    def registration(self, test_image, ref_image):
+    def __init__(self, filter_chain=None):
+        """
+        Keyword arguments:
+        :param filter_chain: image_filter 단계 정의 목록 (None 이면 기본 단계)
+        """
+        self.filter_chain = FilterChain(filter_chain)
+        self.last_homography = None
+        self.last_boxes = np.zeros((0, 4), dtype=np.int64)
+        self.last_source_boxes = np.zeros((0, 4), dtype=np.int64)
+        self.buffers = BufferPool()
+        self.stats = collections.Counter()
+
+    def registration(self, test_image, ref_image=None, reference=None, return_homography=False, **kwargs):
         """
         dataset 이미지와 test 이미지의 구도를 맞춤
         Keyword arguments:
-        :param test_image: 테스트 이미지
+        :param test_image: 테스트 이미지 (컬러 또는 흑백 이미지, 또는 ImageContext)
         :param ref_image: 기준 이미지
+        :param reference: ReferenceStore 에서 얻은 기준 이미지 특징 (ref_image 대신 사용)
+        :param return_homography: True 면 (변환된 이미지, 호모그래피) 반환
+        :param kwargs: find_homography 옵션 (alignment, matcher, estimator, pyramid_size 등)
         :return: 변환된 테스트 이미지
         """
+        height, width = reference.shape if reference is not None else ref_image.shape[:2]
+        homography, _ = self.find_homography(test_image, ref_image, reference=reference, **kwargs)
+
+        # Use this matrix to transform the
+        # colored image wrt the dataset image.
+        source = test_image.image if isinstance(test_image, ImageContext) else test_image
+        transformed_img = cv2.warpPerspective(source, homography, (width, height))
+
+        if return_homography:
+            return transformed_img, homography
+
+        return transformed_img
+
+    def find_homography(self, test_image, ref_image=None, reference=None, alignment='homography',
+                        max_residual=1.0, **kwargs):
+        """
+        test 이미지를 기준 이미지로 옮기는 호모그래피 추정
+        Keyword arguments:
+        :param test_image: 테스트 이미지 (또는 ImageContext)
+        :param ref_image: 기준 이미지
+        :param reference: ReferenceStore 에서 얻은 기준 이미지 특징 (ref_image 대신 사용)
+        :param alignment: 정합 방식
+                          homography (ORB 특징 매칭), phase (평행 이동 위상 상관), ecc (affine ECC),
+                          fiducial (기준 마크 template matching),
+                          reuse (직전 보드의 호모그래피 재사용), auto (reuse -> fiducial -> phase -> homography)
+        :param max_residual: reuse, auto 에서 빠른 정합을 받아들일 최대 잔차 (pixel)
+        :param kwargs: feature_homography 옵션
+        :return homography, mask: 3x3 호모그래피, inlier 마스크 (특징 매칭을 쓰지 않은 경우 None)
+        """
         # Convert to grayscale.
-        if len(test_image.shape) == 3:
+        if isinstance(test_image, ImageContext):
+            img1 = test_image.gray()
+        elif len(test_image.shape) == 3:
             img1 = cv2.cvtColor(test_image, cv2.COLOR_BGR2GRAY)
-            img2 = cv2.cvtColor(ref_image, cv2.COLOR_BGR2GRAY)
         else:
             img1 = test_image
-            img2 = ref_image
 
-        height, width = img2.shape
-        orb_detector = cv2.ORB_create(5000)
+        if reference is not None:
+            img2 = reference.gray
+        else:
+            img2 = cv2.cvtColor(ref_image, cv2.COLOR_BGR2GRAY) if len(ref_image.shape) == 3 else ref_image
+
+        has_fiducials = reference is not None and len(reference.fiducials) >= 3
+
+        homography, mask = None, None
+        if alignment == 'phase':
+            homography = self.phase_homography(img1, img2)
+        elif alignment == 'ecc':
+            homography = self.ecc_homography(img1, img2)
+        elif alignment == 'fiducial':
+            # Falls back to feature matching below when the reference has no fiducials or too few are found.
+            if has_fiducials:
+                homography = self.fiducial_homography(img1, reference)
+        elif alignment in ('reuse', 'auto'):
+            # Fixed fixtures: try the cheap candidates first and keep the first one that passes the residual test.
+            if self.last_homography is not None and \
+                    self.check_alignment(img1, img2, self.last_homography, max_residual=max_residual):
+                homography = self.last_homography
+            elif alignment == 'auto':
+                candidates = []
+                if has_fiducials:
+                    candidates.append(lambda: self.fiducial_homography(img1, reference))
+                candidates.append(lambda: self.phase_homography(img1, img2))
+                for candidate in candidates:
+                    candidate = candidate()
+                    if candidate is not None and \
+                            self.check_alignment(img1, img2, candidate, max_residual=max_residual):
+                        homography = candidate
+                        break
+        elif alignment != 'homography':
+            raise ValueError('Unknown alignment: {}'.format(alignment))
+
+        if homography is None:
+            homography, mask = self.feature_homography(img1, img2, reference=reference, **kwargs)
+        self.last_homography = homography
+
+        return homography, mask
+
+    def feature_homography(self, img1, img2, reference=None, matcher='bf', ratio=0.75, max_matches=None,
+                           estimator='ransac', reproj_threshold=3.0, pyramid_size=None, refine='window'):
+        """
+        ORB 특징 매칭으로 호모그래피 추정
+        Keyword arguments:
+        :param img1: 흑백 테스트 이미지
+        :param img2: 흑백 기준 이미지
+        :param reference: ReferenceStore 에서 얻은 기준 이미지 특징
+        :param matcher: 특징 매칭 방식 (bf, knn, flann)
+        :param ratio: knn, flann 매칭의 ratio test 기준
+        :param max_matches: 거리 순으로 남길 최대 매칭 수 (None 이면 전부 사용)
+        :param estimator: 강건 추정 방식 (ransac, rho, usac)
+        :param reproj_threshold: inlier 로 판단할 재투영 오차 (pixel)
+        :param pyramid_size: 축소 이미지의 긴 변 길이 (None 이면 원본 해상도에서 추정)
+        :param refine: 축소 추정 후 원본 해상도 보정 방식 (window, ecc, None)
+        :return homography, mask: 3x3 호모그래피, inlier 마스크
+        """
+        scale = 1.0
+        if pyramid_size is not None:
+            scale = min(1.0, float(pyramid_size) / max(img2.shape))
 
         # Find keypoints and descriptors.
+        # Reference features are computed once per golden image by the store.
+        if scale < 1.0:
+            small1 = cv2.resize(img1, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            n_features = feature_budget(small1.shape)
+            kp1, d1 = self.orb_features(small1, n_features)
+            if reference is not None:
+                kp2, d2 = reference.features(scale, n_features)
+            else:
+                small2 = cv2.resize(img2, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                kp2, d2 = self.orb_features(small2, n_features)
+        else:
+            kp1, d1 = self.orb_features(img1)
+            if reference is not None:
+                kp2, d2 = reference.keypoints, reference.descriptors
+            else:
+                kp2, d2 = self.orb_features(img2)
+
+        query_idx, train_idx = self.match_features(d1, d2, matcher=matcher, ratio=ratio, max_matches=max_matches)
+        if len(query_idx) < 4:
+            raise ValueError('Not enough feature matches for homography: {}'.format(len(query_idx)))
+
+        # Gather matched coordinates with fancy indexing instead of a per-match loop.
+        p1 = kp1[query_idx]
+        p2 = kp2[train_idx]
+
+        # Find the homography matrix.
+        homography, mask = cv2.findHomography(p1, p2, ESTIMATORS[estimator], reproj_threshold * scale)
+        if homography is None:
+            raise ValueError('Homography estimation failed ({} matches)'.format(len(query_idx)))
+
+        if scale < 1.0:
+            # Lift the coarse estimate to full resolution, then correct the residual quantisation error.
+            S = np.diag([scale, scale, 1.0])
+            homography = np.linalg.inv(S) @ homography @ S
+            if refine == 'window':
+                homography = self.refine_window(img1, img2, homography, radius=int(np.ceil(2 / scale)),
+                                                estimator=estimator, reproj_threshold=reproj_threshold)
+            elif refine == 'ecc':
+                homography = self.refine_ecc(img1, img2, homography)
+
+        return homography, mask
+
+    def orb_features(self, gray, n_features=ORB_FEATURES):
+        """
+        ORB 특징점 좌표와 기술자
+        Keyword arguments:
+        :param gray: 흑백 이미지
+        :param n_features: 특징점 수
+        :return keypoints, descriptors: 특징점 좌표 (N, 2), 기술자 (N, 32)
+        """
         # The first arg is the image, second arg is the mask
         #  (which is not reqiured in this case).
-        kp1, d1 = orb_detector.detectAndCompute(img1, None)
-        kp2, d2 = orb_detector.detectAndCompute(img2, None)
+        keypoints, descriptors = cv2.ORB_create(n_features).detectAndCompute(gray, None)
+        keypoints = cv2.KeyPoint_convert(keypoints).reshape(-1, 2)
+        if descriptors is None:
+            descriptors = np.zeros((0, 32), dtype=np.uint8)
+
+        return keypoints, descriptors
+
+    def window_matches(self, test_gray, ref_gray, homography, radius, grid=6, patch=128, min_score=0.7):
+        """
+        격자 위치의 작은 창에서 호모그래피로 옮긴 test 이미지와 기준 이미지의 남은 어긋남 측정
+        Keyword arguments:
+        :param test_gray: 흑백 테스트 이미지
+        :param ref_gray: 흑백 기준 이미지
+        :param homography: test -> 기준 호모그래피
+        :param radius: 탐색 반경 (pixel)
+        :param grid: 격자 한 변의 패치 수
+        :param patch: 패치 크기 (pixel)
+        :param min_score: 사용할 최소 정규 상관 계수
+        :return ref_pts, shifts: 기준 이미지의 패치 중심 (N, 2), 기준 좌표계의 남은 어긋남 (N, 2)
+        """
+        height, width = ref_gray.shape
+        size = patch + 2 * radius
+        xs = np.linspace(radius, width - size, grid + 2)[1:-1].astype(int)
+        ys = np.linspace(radius, height - size, grid + 2)[1:-1].astype(int)
+
+        ref_pts = []
+        shifts = []
+        for y in ys:
+            for x in xs:
+                template = ref_gray[y + radius:y + radius + patch, x + radius:x + radius + patch]
+                if template.std() < 5:
+                    continue
+                # Resample only the search window of the test image into reference coordinates,
+                # so that the remaining misalignment is a small translation.
+                T = np.array([[1, 0, -x], [0, 1, -y], [0, 0, 1]], dtype=np.float64) @ homography
+                window = cv2.warpPerspective(test_gray, T, (size, size))
+                score = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+                _, max_val, _, (dx, dy) = cv2.minMaxLoc(score)
+                if max_val < min_score:
+                    continue
+                ref_pts.append((x + radius, y + radius))
+                shifts.append((dx - radius + subpixel_peak(score[dy, :], dx),
+                               dy - radius + subpixel_peak(score[:, dx], dy)))
+
+        ref_pts = np.float32(ref_pts).reshape(-1, 2) + (patch - 1) / 2.
+
+        return ref_pts, np.float32(shifts).reshape(-1, 2)
+
+    def refine_window(self, test_gray, ref_gray, homography, radius, estimator='ransac', reproj_threshold=3.0):
+        """
+        원본 해상도에서 작은 탐색 창 template matching 으로 호모그래피 보정
+        Keyword arguments:
+        :param test_gray: 흑백 테스트 이미지
+        :param ref_gray: 흑백 기준 이미지
+        :param homography: 축소 이미지에서 추정 후 원본 크기로 옮긴 호모그래피
+        :param radius: 탐색 반경 (pixel)
+        :return homography: 보정된 호모그래피 (보정 실패 시 입력 그대로)
+        """
+        ref_pts, shifts = self.window_matches(test_gray, ref_gray, homography, radius)
+        if len(ref_pts) < 4:
+            return homography
+
+        test_pts = cv2.perspectiveTransform((ref_pts + shifts).reshape(-1, 1, 2), np.linalg.inv(homography))
+        refined, _ = cv2.findHomography(test_pts, ref_pts, ESTIMATORS[estimator], reproj_threshold)
 
-        # Match features between the two images.
-        # We create a Brute Force matcher with
-        # Hamming distance as measurement mode.
-        matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+        return refined if refined is not None else homography
 
-        # Match the two sets of descriptors.
-        matches = matcher.match(d1, d2)
+    def check_alignment(self, test_gray, ref_gray, homography, max_residual=1.0, radius=8):
+        """
+        9개의 작은 창에서 잔차를 재어 호모그래피가 충분히 정확한지 확인
+        Keyword arguments:
+        :param test_gray: 흑백 테스트 이미지
+        :param ref_gray: 흑백 기준 이미지
+        :param homography: 확인할 test -> 기준 호모그래피
+        :param max_residual: 허용할 잔차 중간값 (pixel)
+        :param radius: 탐색 반경 (pixel)
+        :return: 통과 여부
+        """
+        _, shifts = self.window_matches(test_gray, ref_gray, homography, radius, grid=3)
+        if len(shifts) < 4:
+            return False
 
-        # Sort matches on the basis of their Hamming distance.
-        matches.sort(key=lambda x: x.distance)
+        return float(np.median(np.linalg.norm(shifts, axis=1))) <= max_residual
 
-        # Take the top 90 % matches forward.
-        matches = matches[:int(len(matches) * 50)]
-        no_of_matches = len(matches)
+    def phase_homography(self, test_gray, ref_gray, window=1024):
+        """
+        중앙 창의 위상 상관으로 평행 이동만 추정
+        Keyword arguments:
+        :param test_gray: 흑백 테스트 이미지
+        :param ref_gray: 흑백 기준 이미지
+        :param window: 위상 상관에 쓰는 중앙 창 크기 (pixel)
+        :return homography: 평행 이동 호모그래피
+        """
+        # Translation is global, so a full-resolution centre crop keeps sub-pixel accuracy at a fraction of the cost.
+        height = min(window, ref_gray.shape[0], test_gray.shape[0])
+        width = min(window, ref_gray.shape[1], test_gray.shape[1])
+        y, x = (ref_gray.shape[0] - height) // 2, (ref_gray.shape[1] - width) // 2
+        ref_crop = np.float32(ref_gray[y:y + height, x:x + width])
+        test_crop = np.float32(test_gray[y:y + height, x:x + width])
 
-        # Define empty matrices of shape no_of_matches * 2.
-        p1 = np.zeros((no_of_matches, 2))
-        p2 = np.zeros((no_of_matches, 2))
+        (dx, dy), _ = cv2.phaseCorrelate(ref_crop, test_crop, cv2.createHanningWindow((width, height), cv2.CV_32F))
 
-        for i in range(len(matches)):
-            p1[i, :] = kp1[matches[i].queryIdx].pt
-            p2[i, :] = kp2[matches[i].trainIdx].pt
+        return np.array([[1, 0, -dx], [0, 1, -dy], [0, 0, 1]], dtype=np.float64)
 
-        # Find the homography matrix.
-        homography, mask = cv2.findHomography(p1, p2, cv2.RANSAC)
+    def fiducial_homography(self, test_gray, reference, radius=64, min_score=0.8):
+        """
+        기준 이미지에 정의된 fiducial 마크를 작은 창에서 찾아 호모그래피 추정
+        Keyword arguments:
+        :param test_gray: 흑백 테스트 이미지
+        :param reference: fiducial 영역이 저장된 기준 이미지 특징
+        :param radius: 예상 위치 주변 탐색 반경 (pixel)
+        :param min_score: 사용할 최소 정규 상관 계수
+        :return homography: 4개 이상이면 호모그래피, 3개면 affine (찾지 못하면 None)
+        """
+        # Search around where the previous board put each mark; the fixture rarely moves.
+        expected = reference.fiducials[:, :2] + (reference.fiducials[:, 2:] - 1) / 2.
+        if self.last_homography is not None:
+            expected = cv2.perspectiveTransform(np.float32(expected).reshape(-1, 1, 2),
+                                                np.linalg.inv(self.last_homography)).reshape(-1, 2)
+
+        test_pts = []
+        ref_pts = []
+        height, width = test_gray.shape
+        for (x, y, w, h), (cx, cy) in zip(reference.fiducials, expected):
+            template = reference.gray[y:y + h, x:x + w]
+            x0, y0 = int(round(cx - (w - 1) / 2.)) - radius, int(round(cy - (h - 1) / 2.)) - radius
+            x1, y1 = x0 + w + 2 * radius, y0 + h + 2 * radius
+            if x0 < 0 or y0 < 0 or x1 > width or y1 > height:
+                continue
+            score = cv2.matchTemplate(test_gray[y0:y1, x0:x1], template, cv2.TM_CCOEFF_NORMED)
+            _, max_val, _, (dx, dy) = cv2.minMaxLoc(score)
+            if max_val < min_score:
+                continue
+            test_pts.append((x0 + dx + subpixel_peak(score[dy, :], dx) + (w - 1) / 2.,
+                             y0 + dy + subpixel_peak(score[:, dx], dy) + (h - 1) / 2.))
+            ref_pts.append((x + (w - 1) / 2., y + (h - 1) / 2.))
 
-        # Use this matrix to transform the
-        # colored image wrt the dataset image.
-        transformed_img = cv2.warpPerspective(test_image, homography, (width, height))
+        test_pts = np.float32(test_pts).reshape(-1, 2)
+        ref_pts = np.float32(ref_pts).reshape(-1, 2)
+        if len(ref_pts) >= 4:
+            homography, _ = cv2.findHomography(test_pts, ref_pts, 0)
+            return homography
+        if len(ref_pts) == 3:
+            return np.vstack([cv2.getAffineTransform(test_pts, ref_pts), [0, 0, 1]])
 
-        return transformed_img
+        return None
+
+    def ecc_homography(self, test_gray, ref_gray, size=1024, iterations=50, eps=1e-5):
+        """
+        축소 이미지에서 affine ECC 로 추정
+        Keyword arguments:
+        :param test_gray: 흑백 테스트 이미지
+        :param ref_gray: 흑백 기준 이미지
+        :param size: 축소 이미지의 긴 변 길이
+        :return homography: affine 호모그래피
+        """
+        scale = min(1.0, float(size) / max(ref_gray.shape))
+        ref_small = cv2.resize(ref_gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        test_small = cv2.resize(test_gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        # ECC estimates the reference -> test mapping, i.e. the inverse of our homography.
+        warp = np.eye(2, 3, dtype=np.float32)
+        criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, iterations, eps)
+        _, warp = cv2.findTransformECC(ref_small, test_small, warp, cv2.MOTION_AFFINE, criteria, None, 5)
+
+        S = np.diag([scale, scale, 1.0])
+        warp = np.linalg.inv(S) @ np.vstack([warp, [0, 0, 1]]).astype(np.float64) @ S
+
+        return np.linalg.inv(warp)
+
+    def refine_ecc(self, test_gray, ref_gray, homography, iterations=30, eps=1e-5):
+        """
+        원본 해상도에서 ECC 로 호모그래피 보정
+        Keyword arguments:
+        :param test_gray: 흑백 테스트 이미지
+        :param ref_gray: 흑백 기준 이미지
+        :param homography: 초기 호모그래피
+        :return homography: 보정된 호모그래피 (수렴 실패 시 입력 그대로)
+        """
+        # ECC estimates the reference -> test mapping, i.e. the inverse of our homography.
+        warp = np.linalg.inv(homography).astype(np.float32)
+        criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, iterations, eps)
+        try:
+            _, warp = cv2.findTransformECC(ref_gray, test_gray, warp, cv2.MOTION_HOMOGRAPHY, criteria, None, 5)
+        except cv2.error:
+            return homography
+        refined = np.linalg.inv(warp.astype(np.float64))
+
+        return refined / refined[2, 2]
+
+    def match_features(self, d1, d2, matcher='bf', ratio=0.75, max_matches=None):
+        """
+        ORB 기술자 매칭
+        Keyword arguments:
+        :param d1: 테스트 이미지 기술자
+        :param d2: 기준 이미지 기술자
+        :param matcher: bf (cross check), knn (ratio test), flann (LSH + ratio test)
+        :param ratio: knn, flann 매칭의 ratio test 기준
+        :param max_matches: 거리 순으로 남길 최대 매칭 수 (None 이면 전부 사용)
+        :return query_idx, train_idx: 거리 순으로 정렬된 매칭 인덱스
+        """
+        if d1 is None or d2 is None or len(d1) == 0 or len(d2) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        if matcher == 'bf':
+            # Brute Force matcher with Hamming distance, keeping mutual best matches only.
+            matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(d1, d2)
+        elif matcher in ('knn', 'flann'):
+            if matcher == 'knn':
+                knn_matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+            else:
+                knn_matcher = cv2.FlannBasedMatcher(FLANN_LSH_PARAMS, dict(checks=50))
+            # Lowe's ratio test; LSH may return fewer than two neighbours for some queries.
+            matches = [m[0] for m in knn_matcher.knnMatch(d1, d2, k=2)
+                       if len(m) == 2 and m[0].distance < ratio * m[1].distance]
+        else:
+            raise ValueError('Unknown matcher: {}'.format(matcher))
+
+        if len(matches) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        table = np.array([(m.queryIdx, m.trainIdx, m.distance) for m in matches])
+
+        # Sort matches on the basis of their Hamming distance and keep the best ones.
+        order = np.argsort(table[:, 2], kind='stable')[:max_matches]
 
-    def image_comparison(self, img_A, img_B):
+        return table[order, 0].astype(np.int64), table[order, 1].astype(np.int64)
+
+    def binarization(self, image):
+        """
+        히스토그램 평활화, 블러, 적응형 이진화
+        Keyword arguments:
+        :param image: 컬러 또는 흑백 이미지
+        :return binary: 이진 이미지
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
+        gray = cv2.equalizeHist(gray)
+        gray_blur = cv2.GaussianBlur(gray, BLUR_KSIZE, 0)
+        binary = cv2.adaptiveThreshold(gray_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                       THRESH_BLOCK_SIZE, THRESH_C)
+
+        return binary
+
+    def image_comparison(self, img_A, img_B=None, reference=None, dst=None, tile_size=None, workers=None):
         """
         이미지 A 와 B를 XOR
         Keyword arguments:
-        :param  img_A:  테스트 이미지
+        :param  img_A:  테스트 이미지 (또는 ImageContext)
         :param  img_B:  기준 이미지
+        :param  reference:  ReferenceStore 에서 얻은 기준 이미지 특징 (img_B 대신 사용)
+        :param  dst:  결과를 쓸 배열 (None 이면 새로 할당)
+        :param  tile_size:  타일 크기 (None 이면 한 번에 처리)
+        :param  workers:  타일 처리 스레드 수
         :return diff :  두 이미지의 차이 이미지
         """
-        gray_A = cv2.equalizeHist(cv2.cvtColor(img_A, cv2.COLOR_BGR2GRAY))
-        gray_A_blur = cv2.GaussianBlur(gray_A, (5, 5), 0)
-        binary_A = cv2.adaptiveThreshold(gray_A_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 5, 2)
-
         # dataset images
-        gray_B = cv2.equalizeHist(cv2.cvtColor(img_B, cv2.COLOR_BGR2GRAY))
-        gray_B_blur = cv2.GaussianBlur(gray_B, (5, 5), 0)
-        binary_B = cv2.adaptiveThreshold(gray_B_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 5, 2)
+        binary_B = reference.binary if reference is not None else self.binarization(img_B)
+
+        if tile_size is None:
+            binary_A = img_A.binary() if isinstance(img_A, ImageContext) else self.binarization(img_A)
+
+            # XOR method
+            return cv2.bitwise_xor(binary_A, binary_B, dst=dst)
 
-        # opening = cv2.morphologyEx(diff, cv2.MORPH_OPEN, kernel2)
-        test_img = np.expand_dims(binary_A, 2)
-        ref_img = np.expand_dims(binary_B, 2)
+        # Histogram equalization is global, so only the local blur/threshold/XOR steps are tiled.
+        equalized = self.equalized(img_A)
+        dst = dst if dst is not None else np.empty(binary_B.shape, dtype=np.uint8)
 
-        # XOR method
-        diff = cv2.bitwise_xor(test_img, ref_img)
+        return run_tiled(lambda ys, xs: self.compare_region(equalized, binary_B, ys, xs), binary_B.shape, dst,
+                         tile_size, COMPARISON_HALO, workers)
 
-        return diff
+    def equalized(self, image):
+        """히스토그램 평활화된 흑백 이미지 (ImageContext 면 저장된 결과 사용)"""
+        if isinstance(image, ImageContext):
+            return image.equalized()
 
-    def image_filter(self, diff):
+        return cv2.equalizeHist(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image)
+
+    def compare_region(self, equalized, binary_B, ys, xs):
+        """
+        평활화된 테스트 이미지의 한 영역을 이진화하고 기준 이진 이미지와 XOR
+        Keyword arguments:
+        :param equalized: 히스토그램 평활화된 테스트 이미지
+        :param binary_B: 이진화된 기준 이미지
+        :param ys: y 슬라이스
+        :param xs: x 슬라이스
+        :return diff: 영역의 차이 이미지
+        """
+        gray_blur = cv2.GaussianBlur(equalized[ys, xs], BLUR_KSIZE, 0)
+        binary_A = cv2.adaptiveThreshold(gray_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                         THRESH_BLOCK_SIZE, THRESH_C)
+
+        return cv2.bitwise_xor(binary_A, binary_B[ys, xs])
+
+    def image_filter(self, diff, dst=None, tile_size=None, workers=None, morphology='exact'):
         """
         XOR 후  주요 특징만 추출
         Keyword arguments:
         :param diff: XOR 이미지
+        :param dst: 결과를 쓸 배열 (None 이면 새로 할당)
+        :param tile_size: 타일 크기 (None 이면 한 번에 처리)
+        :param workers: 타일 처리 스레드 수
+        :param morphology: exact (타원 구조 요소 그대로), fast (사각형 + 십자 분해로 근사)
         :return filter7: 필터링 된 이미지
         """
-        # kernel
-        kernel1 = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15))
-        kernel2 = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-        kernel3 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (29, 29))
-        kernel4 = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-        kernel5 = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 1))
+        if tile_size is None:
+            # Two scratch buffers are reused across stages and calls instead of a fresh array per stage.
+            buffer1 = self.buffers.get('filter.1', diff.shape)
+            buffer2 = self.buffers.get('filter.2', diff.shape)
+
+            return self.filter_stages(diff, buffer1, buffer2, dst, morphology=morphology)
+
+        # Tiles run concurrently, so each one works in its own scratch arrays.
+        dst = dst if dst is not None else np.empty(diff.shape, dtype=np.uint8)
 
-        # filtering
-        filter1 = cv2.medianBlur(diff, 5)  # image, ksize
-        filter2 = cv2.morphologyEx(filter1, cv2.MORPH_CLOSE, kernel1)
-        filter3 = cv2.morphologyEx(filter2, cv2.MORPH_OPEN, kernel2)
-        filter4 = cv2.medianBlur(filter3, 5)  # image, ksize
-        filter5 = cv2.morphologyEx(filter4, cv2.MORPH_CLOSE, kernel3)
-        filter6 = cv2.morphologyEx(filter5, cv2.MORPH_OPEN, kernel4)
-        filter7 = cv2.morphologyEx(filter6, cv2.MORPH_OPEN, kernel5)
+        return run_tiled(lambda ys, xs: self.filter_stages(diff[ys, xs], morphology=morphology), diff.shape, dst,
+                         tile_size, self.filter_chain.halo, workers)
 
-        return filter7
+    def filter_stages(self, diff, buffer1=None, buffer2=None, dst=None, morphology='exact'):
+        """
+        filter_chain 에 선언된 중앙값 / 형태학 필터 단계
+        Keyword arguments:
+        :param diff: XOR 이미지
+        :param buffer1: 중간 결과 버퍼
+        :param buffer2: 중간 결과 버퍼
+        :param dst: 결과를 쓸 배열
+        :param morphology: exact, fast (image_filter 참고)
+        :return filter7: 필터링 된 이미지
+        """
+        return self.filter_chain.run(diff, buffer1, buffer2, dst, morphology=morphology)
 
-    def image_defect(self, filter7, img_A, size, correction, filename1, filename2, crop_path, origin_path, result_path=""):
+    def screening(self, test_gray, homography, ref_image=None, reference=None, scale=0.25, margin=16):
+        """
+        저해상도 XOR 로 보드 전체의 차이 점수와 결함 후보 영역 계산
+        Keyword arguments:
+        :param test_gray: 흑백 테스트 이미지 (정합 전)
+        :param homography: test -> 기준 호모그래피
+        :param ref_image: 기준 이미지
+        :param reference: ReferenceStore 에서 얻은 기준 이미지 특징 (ref_image 대신 사용)
+        :param scale: 저해상도 비율
+        :param margin: 후보 영역에 더할 여백 (원본 pixel)
+        :return score, regions, area: 차이 pixel 비율, 원본 좌표계의 후보 영역 [(y, x, h, w), ...], 후보 영역 넓이
+        """
+        if reference is not None:
+            ref_binary = reference.screening_binary(scale)
+        else:
+            ref_gray = cv2.cvtColor(ref_image, cv2.COLOR_BGR2GRAY) if len(ref_image.shape) == 3 else ref_image
+            ref_binary = self.binarization(cv2.resize(ref_gray, None, fx=scale, fy=scale,
+                                                      interpolation=cv2.INTER_AREA))
+        height, width = ref_binary.shape
+
+        # Warp the already downscaled test image; the full-resolution image is never resampled here.
+        S = np.diag([scale, scale, 1.0])
+        test_small = cv2.resize(test_gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        test_small = cv2.warpPerspective(test_small, S @ homography @ np.linalg.inv(S), (width, height))
+        diff = cv2.bitwise_xor(self.binarization(test_small), ref_binary)
+        diff = cv2.morphologyEx(cv2.medianBlur(diff, 3), cv2.MORPH_OPEN,
+                                cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))
+        score = cv2.countNonZero(diff) / float(diff.size)
+
+        _, _, stats, _ = cv2.connectedComponentsWithStats(diff)
+        pad = int(np.ceil(margin * scale))
+        x0 = np.clip(stats[1:, 0] - pad, 0, width)
+        y0 = np.clip(stats[1:, 1] - pad, 0, height)
+        x1 = np.clip(stats[1:, 0] + stats[1:, 2] + pad, 0, width)
+        y1 = np.clip(stats[1:, 1] + stats[1:, 3] + pad, 0, height)
+
+        # Candidate area is measured on the low resolution grid so overlapping regions are counted once.
+        covered = np.zeros((height, width), dtype=np.uint8)
+        for bx0, by0, bx1, by1 in zip(x0, y0, x1, y1):
+            covered[by0:by1, bx0:bx1] = 1
+        area = int(cv2.countNonZero(covered) / (scale * scale))
+
+        full_height, full_width = reference.shape if reference is not None else ref_image.shape[:2]
+        regions = []
+        for bx0, by0, bx1, by1 in zip(x0, y0, x1, y1):
+            fx0, fy0 = int(bx0 / scale), int(by0 / scale)
+            fx1, fy1 = min(full_width, int(np.ceil(bx1 / scale))), min(full_height, int(np.ceil(by1 / scale)))
+            regions.append((fy0, fx0, fy1 - fy0, fx1 - fx0))
+
+        return score, regions, min(area, full_height * full_width)
+
+    def inspection(self, test_image, ref_image=None, reference=None, warp='image', registration_info=None,
+                   tile_size=None, tile_workers=None, screening=None, morphology='exact', extraction=None,
+                   annotation='image', source_path=None, label_path=None, **kwargs):
+        """
+        정합, 비교, 필터링, 결함 추출을 차례로 수행
+        Keyword arguments:
+        :param test_image: 테스트 이미지
+        :param ref_image: 기준 이미지
+        :param reference: ReferenceStore 에서 얻은 기준 이미지 특징 (ref_image 대신 사용)
+        :param warp: image (컬러 테스트 이미지 전체를 기준 좌표계로 변환),
+                     inverse (흑백 이미지만 변환하고 결함 영역을 역변환해 원본 테스트 이미지에서 자름)
+        :param registration_info: registration 옵션
+        :param tile_size: 비교 / 필터링 타일 크기 (None 이면 한 번에 처리)
+        :param tile_workers: 타일 처리 스레드 수
+        :param screening: 저해상도 선별 옵션 {scale, threshold, margin} (None 이면 사용하지 않음)
+                          threshold 이하인 보드는 바로 통과시키고, 나머지는 후보 영역만 원본 해상도로 처리
+        :param morphology: 필터링의 타원 닫힘 연산 방식 (exact, fast)
+        :param extraction: 결함 추출 옵션 {method, min_area, max_aspect, edge, merge_iou, merge_distance}
+                           (defect_boxes, image_defect 참고)
+        :param annotation: image (결함을 표시한 보드 이미지를 origin_path 에 저장),
+                           label (결함 영역을 LabelFile JSON 으로 저장, 보드 이미지는 다시 쓰지 않음)
+        :param source_path: 테스트 이미지 경로 (CropBatch 출처, label 저장 위치)
+        :param label_path: label JSON 을 쓸 작업 공간 폴더 (None 이면 source_path 옆, defect_labels 참고)
+        :param kwargs: image_defect 옵션 (size, correction, filename1, filename2, crop_path, origin_path)
+        :return: image_defect 결과
+        """
+        if warp not in ('image', 'inverse'):
+            raise ValueError('Unknown warp: {}'.format(warp))
+        if annotation not in ('image', 'label'):
+            raise ValueError('Unknown annotation: {}'.format(annotation))
+        if annotation == 'label' and source_path is None:
+            raise ValueError('annotation=label needs source_path')
+
+        registration_info = registration_info or {}
+        extraction = extraction or {}
+        kwargs.setdefault('edge', extraction.get('edge', 'drop'))
+        kwargs.setdefault('merge_iou', extraction.get('merge_iou'))
+        kwargs.setdefault('merge_distance', extraction.get('merge_distance'))
+        kwargs.setdefault('source', source_path)
+        kwargs['annotate'] = annotation == 'image'
+        test_context = ImageContext(test_image, self.buffers, name='test')
+        height, width = reference.shape if reference is not None else ref_image.shape[:2]
+        homography, _ = self.find_homography(test_context, ref_image, reference=reference, **registration_info)
+
+        regions = None
+        self.stats['boards'] += 1
+        self.stats['pixels'] += height * width
+        if screening is not None:
+            score, regions, area = self.screening(test_context.gray(), homography, ref_image, reference=reference,
+                                                  scale=screening.get('scale', 0.25),
+                                                  margin=screening.get('margin', 16))
+            if score <= screening.get('threshold', 0.):
+                # Clean board: nothing to crop, the board is only written out for the viewer.
+                self.stats['skipped_boards'] += 1
+                self.stats['skipped_pixels'] += height * width
+                board = test_image
+                if warp == 'image' and annotation == 'image':
+                    # Same coordinate frame as the inspected boards written next to it.
+                    board = cv2.warpPerspective(test_image, homography, (width, height))
+                result = self.image_defect(None, board, boxes=np.zeros((0, 4), dtype=np.int64), **kwargs)
+                self.last_source_boxes = self.last_boxes
+                if annotation == 'label':
+                    write_defect_labels(source_path, self.last_boxes, test_image.shape, label_path=label_path)
+                return result
+            self.stats['skipped_pixels'] += height * width - area
+
+        if warp == 'image':
+            transform_image = cv2.warpPerspective(test_image, homography, (width, height))
+        else:
+            # Only one channel is resampled; defects found in reference space are cropped from the original.
+            transform_image = cv2.warpPerspective(test_context.gray(), homography, (width, height),
+                                                  dst=self.buffers.get('transform', (height, width)))
+        transform_context = ImageContext(transform_image, self.buffers, name='transform')
+        filtered_image = self.buffers.get('filtered', (height, width))
+
+        if regions is None:
+            diff_image = self.buffers.get('diff', (height, width))
+            self.image_comparison(transform_context, ref_image, reference=reference, dst=diff_image,
+                                  tile_size=tile_size, workers=tile_workers)
+            self.image_filter(diff_image, dst=filtered_image, tile_size=tile_size, workers=tile_workers,
+                              morphology=morphology)
+        else:
+            # Full-resolution comparison and filtering only inside the low resolution candidates.
+            equalized = transform_context.equalized()
+            binary_B = reference.binary if reference is not None else self.binarization(ref_image)
+            filtered_image[:] = 0
+            run_regions(lambda ys, xs: self.filter_stages(self.compare_region(equalized, binary_B, ys, xs),
+                                                          morphology=morphology),
+                        (height, width), filtered_image, regions, COMPARISON_HALO + self.filter_chain.halo,
+                        tile_workers)
+
+        boxes = self.defect_boxes(filtered_image, method=extraction.get('method', 'contours'),
+                                  min_area=extraction.get('min_area', 0), max_aspect=extraction.get('max_aspect'))
+        if warp == 'image':
+            result = self.image_defect(filtered_image, transform_image, boxes=boxes, **kwargs)
+            source_boxes = self.map_boxes(self.last_boxes, np.linalg.inv(homography))
+        else:
+            result = self.image_defect(filtered_image, test_image,
+                                       boxes=self.map_boxes(boxes, np.linalg.inv(homography)), **kwargs)
+            source_boxes = self.last_boxes
+        self.last_source_boxes = source_boxes
+        if annotation == 'label':
+            write_defect_labels(source_path, source_boxes, test_image.shape, label_path=label_path)
+
+        return result
+
+    def defect_boxes(self, filter7, method='contours', min_area=0, max_aspect=None):
+        """
+        필터링 된 XOR 이미지에서 결함 후보 영역 검출
+        Keyword arguments:
+        :param filter7: 필터링 된 XOR 이미지
+        :param method: contours (외곽선), components (연결 요소 통계, min_area / max_aspect 로 걸러냄)
+        :param min_area: 최소 결함 pixel 수 (components)
+        :param max_aspect: 최대 가로세로 비 (components, None 이면 제한 없음)
+        :return boxes: 결함 후보 영역 (N, 4) [x, y, w, h]
+        """
+        if method == 'components':
+            boxes, _, _ = self.defect_components(filter7, min_area, max_aspect)
+            return boxes
+        if method != 'contours':
+            raise ValueError('Unknown extraction method: {}'.format(method))
+
+        cnts = cv2.findContours(filter7, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        cnts = imutils.grab_contours(cnts)
+
+        return np.array([cv2.boundingRect(c) for c in cnts], dtype=np.int64).reshape(-1, 4)
+
+    def defect_components(self, filter7, min_area=0, max_aspect=None):
+        """
+        연결 요소 통계로 결함 후보 영역, 넓이, 중심을 한 번에 계산하고 자르기 전에 걸러냄
+        Keyword arguments:
+        :param filter7: 필터링 된 XOR 이미지
+        :param min_area: 최소 결함 pixel 수
+        :param max_aspect: 최대 가로세로 비 (None 이면 제한 없음)
+        :return boxes, areas, centroids: (N, 4) [x, y, w, h], (N,) pixel 수, (N, 2) [x, y]
+        """
+        _, _, stats, centroids = cv2.connectedComponentsWithStats(filter7, connectivity=8)
+        # Label 0 is the background.
+        boxes = stats[1:, :4].astype(np.int64)
+        areas = stats[1:, cv2.CC_STAT_AREA].astype(np.int64)
+        centroids = centroids[1:]
+
+        keep = areas >= min_area
+        if max_aspect is not None:
+            w, h = boxes[:, 2], boxes[:, 3]
+            keep &= np.maximum(w, h) <= max_aspect * np.minimum(w, h)
+        self.stats['components'] += len(boxes)
+        self.stats['rejected_components'] += int(np.count_nonzero(~keep))
+
+        return boxes[keep], areas[keep], centroids[keep]
+
+    def map_boxes(self, boxes, homography):
+        """
+        결함 영역을 호모그래피로 옮긴 뒤 감싸는 사각형
+        Keyword arguments:
+        :param boxes: 결함 영역 (N, 4) [x, y, w, h]
+        :param homography: 3x3 호모그래피
+        :return boxes: 옮겨진 결함 영역 (N, 4) [x, y, w, h]
+        """
+        if len(boxes) == 0:
+            return boxes
+
+        x, y, w, h = boxes.T
+        corners = np.stack([np.stack([x, y], 1), np.stack([x + w, y], 1),
+                            np.stack([x, y + h], 1), np.stack([x + w, y + h], 1)], 1)
+        corners = cv2.perspectiveTransform(np.float64(corners).reshape(-1, 1, 2), homography).reshape(-1, 4, 2)
+        top_left = np.floor(corners.min(axis=1)).astype(np.int64)
+        bottom_right = np.ceil(corners.max(axis=1)).astype(np.int64)
+
+        return np.hstack([top_left, bottom_right - top_left])
+
+    def merge_boxes(self, boxes, iou_threshold=None, distance=None):
+        """
+        겹치거나 가까운 결함 영역을 하나로 합침
+        IoU 가 iou_threshold 이상이거나 간격이 distance 이하인 영역끼리 연결하고, 연결된 묶음을 감싸는 사각형으로 바꾼다.
+        Keyword arguments:
+        :param boxes: 결함 영역 (N, 4) [x, y, w, h]
+        :param iou_threshold: 합칠 최소 IoU (None 이면 사용하지 않음)
+        :param distance: 합칠 최대 간격 pixel (None 이면 사용하지 않음, 0 이면 맞닿은 영역까지)
+        :return boxes: 합쳐진 결함 영역 (M, 4)
+        """
+        boxes = boxes.reshape(-1, 4)
+        if len(boxes) < 2 or (iou_threshold is None and distance is None):
+            return boxes
+
+        count = len(boxes)
+        while True:
+            x0, y0 = boxes[:, 0], boxes[:, 1]
+            x1, y1 = x0 + boxes[:, 2], y0 + boxes[:, 3]
+            areas = boxes[:, 2] * boxes[:, 3]
+            rows, cols = [], []
+            # The pairwise matrices are built a block of rows at a time to bound memory on noisy boards.
+            for start in range(0, len(boxes), MERGE_CHUNK):
+                block = slice(start, start + MERGE_CHUNK)
+                gap_x = np.maximum(x0[block, None], x0[None]) - np.minimum(x1[block, None], x1[None])
+                gap_y = np.maximum(y0[block, None], y0[None]) - np.minimum(y1[block, None], y1[None])
+                link = np.zeros(gap_x.shape, dtype=bool)
+                if distance is not None:
+                    link |= np.maximum(gap_x, gap_y) <= distance
+                if iou_threshold is not None:
+                    inter = np.clip(-gap_x, 0, None) * np.clip(-gap_y, 0, None)
+                    union = areas[block, None] + areas[None] - inter
+                    link |= inter >= iou_threshold * np.maximum(union, 1)
+                r, c = np.nonzero(link)
+                rows.append(r + start)
+                cols.append(c)
+            rows, cols = np.concatenate(rows), np.concatenate(cols)
+            graph = scipy.sparse.coo_matrix((np.ones(len(rows), dtype=bool), (rows, cols)),
+                                            shape=(len(boxes), len(boxes)))
+            n_groups, labels = scipy.sparse.csgraph.connected_components(graph, directed=False)
+            if n_groups == len(boxes):
+                break
+
+            merged_x0 = np.full(n_groups, np.iinfo(np.int64).max)
+            merged_y0 = np.full(n_groups, np.iinfo(np.int64).max)
+            merged_x1 = np.full(n_groups, np.iinfo(np.int64).min)
+            merged_y1 = np.full(n_groups, np.iinfo(np.int64).min)
+            np.minimum.at(merged_x0, labels, x0)
+            np.minimum.at(merged_y0, labels, y0)
+            np.maximum.at(merged_x1, labels, x1)
+            np.maximum.at(merged_y1, labels, y1)
+            # A merged box can reach boxes none of its members touched, so repeat until nothing changes.
+            boxes = np.stack([merged_x0, merged_y0, merged_x1 - merged_x0, merged_y1 - merged_y0], axis=1)
+        self.stats['merged_boxes'] += count - len(boxes)
+
+        return boxes
+
+    def image_defect(self, filter7, img_A, size, correction, filename1, filename2, crop_path, origin_path,
+                     result_path="", boxes=None, edge='drop', merge_iou=None, merge_distance=None, batch=None,
+                     write_crops=True, writer=None, annotate=True, source=None):
         """
         XOR 후 추출된 특징을 자름
         Keyword arguments:
@@ -127,36 +1101,61 @@ class Image:
         :param correction: 자르는 부분의 여백
         :param filename1: 결함 이미지 이름
         :param filename2: 결함이 표시된 테스트 이미지
+        :param boxes: img_A 좌표계의 결함 영역 (None 이면 filter7 에서 검출)
+        :param edge: drop (여백이 위 / 왼쪽 경계를 넘는 결함은 버림), clip (자르는 영역을 이미지 안으로 제한)
+        :param merge_iou: 자르기 전에 합칠 최소 IoU (merge_boxes 참고)
+        :param merge_distance: 자르기 전에 합칠 최대 간격 (merge_boxes 참고)
+        :param batch: 결함 이미지와 출처를 모을 CropBatch (분류 단계로 바로 넘김)
+        :param write_crops: 결함 이미지를 crop_path 에 JPEG 로 저장
+        :param writer: 이미지를 백그라운드에서 저장할 ImageWriter (None 이면 바로 저장)
+        :param annotate: 결함을 표시한 img_A 를 origin_path 에 저장
+        :param source: CropBatch 에 기록할 테스트 이미지 경로
         :return :
         """
-        img_temp = img_A.copy()
-        cnts = cv2.findContours(filter7, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        cnts = imutils.grab_contours(cnts)
+        imwrite = writer.write if writer is not None else cv2.imwrite
+        # Without annotation img_A is never drawn on, so crops can be cut from it directly.
+        img_temp = img_A.copy() if annotate else img_A
+        if boxes is None:
+            boxes = self.defect_boxes(filter7)
+        boxes = self.merge_boxes(boxes, merge_iou, merge_distance)
+        height, width = img_A.shape[:2]
         d = []
 
-        i = 0
-        for c in cnts:
-            (x, y, w, h) = cv2.boundingRect(c)
-
-            if (y - correction < 0) or (x - correction < 0):
-                continue
-            else:
-                temp_img = img_temp[(y - correction):(y + h + correction), (x - correction):(x + w + correction), :]
-                temp_resized = cv2.resize(temp_img, (size, size))
-                d.append(temp_resized)
-                crop_file_name = filename1 + '_' + str(i) + '.jpg'
-                cv2.imwrite(os.path.join(crop_path, crop_file_name), temp_resized)
-                i += 1
-                # save
-                cv2.rectangle(img_A, (x, y), (x + w, y + h), (0, 0, 255), 2)
-
-        cv2.imwrite(os.path.join(origin_path, filename2), img_A)
+        # Crop windows are computed for all boxes at once; only the crop/resize/write remains per box.
+        x, y, w, h = boxes.reshape(-1, 4).T
+        x0, y0, x1, y1 = x - correction, y - correction, x + w + correction, y + h + correction
+        if edge == 'drop':
+            keep = (x0 >= 0) & (y0 >= 0)
+        elif edge == 'clip':
+            keep = np.ones(len(x), dtype=bool)
+        else:
+            raise ValueError('Unknown edge handling: {}'.format(edge))
+        x0, y0 = np.maximum(x0, 0), np.maximum(y0, 0)
+        x1, y1 = np.minimum(x1, width), np.minimum(y1, height)
+        keep &= (x1 > x0) & (y1 > y0)
+
+        for i, j in enumerate(np.flatnonzero(keep)):
+            temp_img = img_temp[y0[j]:y1[j], x0[j]:x1[j], :]
+            temp_resized = cv2.resize(temp_img, (size, size))
+            d.append(temp_resized)
+            crop_file_name = filename1 + '_' + str(i) + '.jpg'
+            if batch is not None:
+                batch.append(temp_resized, crop_file_name, filename2, (x[j], y[j], w[j], h[j]), source)
+            if write_crops:
+                imwrite(os.path.join(crop_path, crop_file_name), temp_resized)
+            # save
+            if annotate:
+                cv2.rectangle(img_A, (int(x[j]), int(y[j])), (int(x[j] + w[j]), int(y[j] + h[j])), (0, 0, 255), 2)
+
+        self.last_boxes = boxes.reshape(-1, 4)[keep]
+        if annotate:
+            imwrite(os.path.join(origin_path, filename2), img_A)
 
         return img_A, d
 
     def generator(self, temp_resized, count, path, crop_name):
         """
-        Keras Image Generator
+        회전 / 확대 증강 이미지 생성 (여러 장은 augmentation.BatchAugmenter 사용)
         Keyword arguments:
         :param temp_resized: 결함 있는 이미지
         :param count: 생성할 이미지 수
@@ -164,22 +1163,103 @@ class Image:
         :param crop_name: 생성된 이미지의 이름
         :return:
         """
-        sample = np.expand_dims(temp_resized, 0)
-        datagen = ImageDataGenerator(rotation_range=180, zoom_range=0.3)
-        it = datagen.flow(sample, batch_size=1)
-        image_generator = []
-
-        for l in range(count):
-            batch = it.next()
-            image_gen = batch[0].astype('uint8')
-            image_generator.append(image_gen)
+        # Same rotation / zoom distribution as the former Keras generator, warped in one batch.
+        for l, image_gen in enumerate(augment(temp_resized, count, rotation_range=180, zoom_range=0.3)):
             cv2.imwrite(path + '/' + crop_name + '_' + str(l) + '.jpg', image_gen)
 
         return
 
 
 class lightness:
-    def lightness_color(self, img, gamma_1=0.3, gamma_2=1.5):
+    def homomorphic(self, images, gamma_1=0.3, gamma_2=1.5):
+        """
+        동형 필터 (float32 rfft2, 같은 크기 이미지 묶음은 한 번의 FFT 로 처리)
+        기존 float64 fft2 구현과의 차이는 uint8 결과에서 최대 1 이다.
+        Keyword arguments:
+        :param images: 밝기 이미지 (H, W) 또는 같은 크기 묶음 (N, H, W) uint8
+        :param gamma_1: 저주파 배율
+        :param gamma_2: 고주파 배율
+        :return: 입력과 같은 모양의 uint8
+        """
+        rows, cols = images.shape[-2:]
+        mask, size = homomorphic_mask(rows, cols, gamma_1, gamma_2)
+
+        # Convert image to 0 to 1, then do log(1 + I)
+        img_log = np.log1p(images.astype(np.float32) * np.float32(1. / 255))
+        # Low and high pass share one spectrum, so both bands come out of a single inverse FFT.
+        spectrum = scipy.fft.rfft2(img_log, size, axes=(-2, -1))
+        spectrum *= mask
+        img_exp = np.expm1(scipy.fft.irfft2(spectrum, size, axes=(-2, -1))[..., :rows, :cols])
+
+        # Rescale every image to [0, 1] on its own
+        low = img_exp.min(axis=(-2, -1), keepdims=True)
+        high = img_exp.max(axis=(-2, -1), keepdims=True)
+        img_exp -= low
+        img_exp *= 255 / (high - low)
+
+        return img_exp.astype(np.uint8)
+
+    def homomorphic_exact(self, img, gamma_1=0.3, gamma_2=1.5):
+        """기존 float64 fft2 동형 필터 (homomorphic 의 기준 구현)"""
+        # Number of rows and columns
+        rows = img.shape[0]
+        cols = img.shape[1]
+
+        # Convert image to 0 to 1, then do log(1 + I)
+        imgLog = np.log1p(np.array(img, dtype="float") / 255)
+
+        # Create Gaussian mask of sigma = 10
+        M = 2 * rows + 1
+        N = 2 * cols + 1
+        sigma = 10
+        (X, Y) = np.meshgrid(np.linspace(0, N - 1, N), np.linspace(0, M - 1, M))
+        centerX = np.ceil(N / 2)
+        centerY = np.ceil(M / 2)
+        gaussianNumerator = (X - centerX) ** 2 + (Y - centerY) ** 2
+
+        # Low pass and high pass filters
+        Hlow = np.exp(-gaussianNumerator / (2 * sigma * sigma))
+        Hhigh = 1 - Hlow
+
+        # Move origin of filters so that it's at the top left corner to match with the input image
+        HlowShift = scipy.fftpack.ifftshift(Hlow.copy())
+        HhighShift = scipy.fftpack.ifftshift(Hhigh.copy())
+
+        # Filter the image and crop
+        If = scipy.fftpack.fft2(imgLog.copy(), (M, N))
+        Ioutlow = np.real(scipy.fftpack.ifft2(If.copy() * HlowShift, (M, N)))
+        Iouthigh = np.real(scipy.fftpack.ifft2(If.copy() * HhighShift, (M, N)))
+
+        # Set scaling factors and add
+        gamma1 = gamma_1
+        gamma2 = gamma_2
+        Iout = gamma1 * Ioutlow[0:rows, 0:cols] + gamma2 * Iouthigh[0:rows, 0:cols]
+
+        # Anti-log then rescale to [0,1]
+        Ihmf = np.expm1(Iout)
+        Ihmf = (Ihmf - np.min(Ihmf)) / (np.max(Ihmf) - np.min(Ihmf))
+        Ihmf2 = np.array(255 * Ihmf, dtype="uint8")
+
+        return Ihmf2
+
+    def lightness_color(self, img, gamma_1=0.3, gamma_2=1.5, method='fast'):
+        """
+        Keyword arguments:
+        :param img: BGR 이미지 (H, W, 3) 또는 같은 크기 묶음 (N, H, W, 3)
+        :param gamma_1: 저주파 배율
+        :param gamma_2: 고주파 배율
+        :param method: fast (homomorphic), exact (기존 float64 fft2 구현)
+        :return: 밝기를 보정한 BGR 이미지
+        """
+        if method == 'fast':
+            images = img if img.ndim == 4 else img[np.newaxis]
+            img_YUV = np.stack([cv2.cvtColor(image, cv2.COLOR_BGR2YUV) for image in images])
+            img_YUV[..., 0] = self.homomorphic(img_YUV[..., 0], gamma_1, gamma_2)
+            result = np.stack([cv2.cvtColor(image, cv2.COLOR_YUV2BGR) for image in img_YUV])
+            return result if img.ndim == 4 else result[0]
+        if method != 'exact':
+            raise ValueError('Unknown method: {}'.format(method))
+
         # Convert image to RGB to YUV
         img_YUV = cv2.cvtColor(img, cv2.COLOR_BGR2YUV)
         y, u, v = cv2.split(img_YUV)
@@ -229,55 +1309,18 @@ class lightness:
 
         return result
 
-    def lightness_gray(self, img, gamma_1=0.3, gamma_2=1.5, threshold=65):
-        def imclearborder(imgBW, radius):
-            # Given a black and white image, first find all of its contours
-            imgBWcopy = imgBW.copy()
-            contours, hierarchy = cv2.findContours(imgBWcopy.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-
-            # Get dimensions of image
-            imgRows = imgBW.shape[0]
-            imgCols = imgBW.shape[1]
-
-            contourList = []  # ID list of contours that touch the border
-
-            # For each contour...
-            for idx in np.arange(len(contours)):
-                # Get the i'th contour
-                cnt = contours[idx]
-
-                # Look at each point in the contour
-                for pt in cnt:
-                    rowCnt = pt[0][1]
-                    colCnt = pt[0][0]
-
-                    # If this is within the radius of the border
-                    # this contour goes bye bye!
-                    check1 = (rowCnt >= 0 and rowCnt < radius) or (rowCnt >= imgRows - 1 - radius and rowCnt < imgRows)
-                    check2 = (colCnt >= 0 and colCnt < radius) or (colCnt >= imgCols - 1 - radius and colCnt < imgCols)
-
-                    if check1 or check2:
-                        contourList.append(idx)
-                        break
-
-            for idx in contourList:
-                cv2.drawContours(imgBWcopy, contours, idx, (0, 0, 0), -1)
-
-            return imgBWcopy
-
-        def bwareaopen(imgBW, areaPixels):
-            # Given a black and white image, first find all of its contours
-            imgBWcopy = imgBW.copy()
-            contours, hierarchy = cv2.findContours(imgBWcopy.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-
-            # For each contour, determine its total occupying area
-            for idx in np.arange(len(contours)):
-                area = cv2.contourArea(contours[idx])
-                if (area >= 0 and area <= areaPixels):
-                    cv2.drawContours(imgBWcopy, contours, idx, (0, 0, 0), -1)
-
-            return imgBWcopy
-
+    def lightness_gray(self, img, gamma_1=0.3, gamma_2=1.5, threshold=65, method='fast', cleanup='components'):
+        """
+        Keyword arguments:
+        :param img: 회색조 이미지
+        :param gamma_1: 저주파 배율
+        :param gamma_2: 고주파 배율
+        :param threshold: 이보다 어두운 pixel 을 결함 후보로
+        :param method: fast (homomorphic), exact (기존 float64 fft2 구현)
+        :param cleanup: components (remove_components, 경계 / 작은 영역을 한 번에 제거),
+                        contours (기존 contour 반복 구현, 결과는 같음)
+        :return Ihmf2, Ithresh, Iopen: 밝기 보정 이미지, 이진 이미지, 경계 / 작은 영역을 지운 이진 이미지
+        """
         # Number of rows and columns
         rows = img.shape[0]
         cols = img.shape[1]
@@ -285,49 +1328,22 @@ class lightness:
         # Remove some columns from the beginning and end
         img = img[:, 59:cols - 20]
 
-        # Number of rows and columns
-        rows = img.shape[0]
-        cols = img.shape[1]
-
-        # Convert image to 0 to 1, then do log(1 + I)
-        imgLog = np.log1p(np.array(img, dtype="float") / 255)
-
-        # Create Gaussian mask of sigma = 10
-        M = 2 * rows + 1
-        N = 2 * cols + 1
-        sigma = 10
-        (X, Y) = np.meshgrid(np.linspace(0, N - 1, N), np.linspace(0, M - 1, M))
-        centerX = np.ceil(N / 2)
-        centerY = np.ceil(M / 2)
-        gaussianNumerator = (X - centerX) ** 2 + (Y - centerY) ** 2
-
-        # Low pass and high pass filters
-        Hlow = np.exp(-gaussianNumerator / (2 * sigma * sigma))
-        Hhigh = 1 - Hlow
-
-        # Move origin of filters so that it's at the top left corner to match with the input image
-        HlowShift = scipy.fftpack.ifftshift(Hlow.copy())
-        HhighShift = scipy.fftpack.ifftshift(Hhigh.copy())
-
-        # Filter the image and crop
-        If = scipy.fftpack.fft2(imgLog.copy(), (M, N))
-        Ioutlow = scipy.real(scipy.fftpack.ifft2(If.copy() * HlowShift, (M, N)))
-        Iouthigh = scipy.real(scipy.fftpack.ifft2(If.copy() * HhighShift, (M, N)))
-
-        # Set scaling factors and add
-        gamma1 = gamma_1
-        gamma2 = gamma_2
-        Iout = gamma1 * Ioutlow[0:rows, 0:cols] + gamma2 * Iouthigh[0:rows, 0:cols]
-
-        # Anti-log then rescale to [0,1]
-        Ihmf = np.expm1(Iout)
-        Ihmf = (Ihmf - np.min(Ihmf)) / (np.max(Ihmf) - np.min(Ihmf))
-        Ihmf2 = np.array(255 * Ihmf, dtype="uint8")
+        if method == 'fast':
+            Ihmf2 = self.homomorphic(np.ascontiguousarray(img), gamma_1, gamma_2)
+        elif method == 'exact':
+            Ihmf2 = self.homomorphic_exact(img, gamma_1, gamma_2)
+        else:
+            raise ValueError('Unknown method: {}'.format(method))
 
         # Threshold the image - Anything below intensity 65 gets set to white
         Ithresh = Ihmf2 < threshold
         Ithresh = 255 * Ithresh.astype("uint8")
 
+        if cleanup == 'components':
+            return Ihmf2, Ithresh, remove_components(Ithresh, radius=5, area=120)
+        if cleanup != 'contours':
+            raise ValueError('Unknown cleanup: {}'.format(cleanup))
+
         # Clear off the border.  Choose a border radius of 5 pixels
         Iclear = imclearborder(Ithresh, 5)
 
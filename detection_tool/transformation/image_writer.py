@@ -0,0 +1,73 @@
+import concurrent.futures
+import threading
+import cv2
+
+
+class ImageWriter:
+    """
+    이미지 인코딩 / 저장을 스레드 풀에서 처리하는 비동기 저장기.
+    대기 중인 저장 수가 max_pending 에 이르면 write 가 기다리므로(backpressure) 메모리가 무한히 늘지 않는다.
+    저장이 끝날 때까지 넘긴 이미지 배열을 수정하면 안 된다.
+    """
+    def __init__(self, workers=2, max_pending=64):
+        """
+        Keyword arguments:
+        :param workers: 저장 스레드 수
+        :param max_pending: 대기할 수 있는 최대 저장 수
+        """
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = set()
+        self._errors = []
+        self._lock = threading.Lock()
+
+    def write(self, path, image, params=None):
+        """
+        저장 예약 (cv2.imwrite 와 같은 인자)
+        Keyword arguments:
+        :param path: 저장 경로
+        :param image: 이미지
+        :param params: cv2.imwrite 인코딩 옵션
+        """
+        self._slots.acquire()
+        future = self._pool.submit(self._write, path, image, params)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+        return True
+
+    def flush(self):
+        """예약된 저장이 모두 끝날 때까지 기다리고, 실패한 저장이 있으면 IOError"""
+        with self._lock:
+            pending = list(self._pending)
+        concurrent.futures.wait(pending)
+
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise IOError('Failed to write {} image(s), first: {}'.format(len(errors), errors[0]))
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write(self, path, image, params):
+        # cv2.imwrite releases the GIL while encoding, so the workers run alongside detection.
+        if not cv2.imwrite(path, image, params or []):
+            raise IOError(path)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+            if future.exception() is not None:
+                self._errors.append(str(future.exception()))
+        self._slots.release()
@@ -0,0 +1,95 @@
+import json
+import os
+
+MANIFEST_FILE = 'manifest.jsonl'
+
+
+def reference_path(board, normal_path):
+    """테스트 이미지의 기준 이미지 경로 (<normal_path>/<이름의 '_' 앞부분>.JPG)"""
+    return os.path.join(normal_path, os.path.basename(board).split('_')[0] + '.JPG')
+
+
+def manifest_entry(board, normal_path, category=None):
+    """
+    Keyword arguments:
+    :param board: 테스트 이미지 경로
+    :param normal_path: 기준 이미지 폴더
+    :param category: 분류 폴더 이름 (None 이면 테스트 이미지의 상위 폴더 이름)
+    :return: {board, reference, class}
+    """
+    board = os.path.abspath(board)
+    category = category if category is not None else os.path.basename(os.path.dirname(board))
+
+    return {'board': board, 'reference': os.path.abspath(reference_path(board, normal_path)), 'class': category}
+
+
+def write_manifest(path, entries):
+    """
+    검사할 보드 목록을 JSON lines 로 저장
+    Keyword arguments:
+    :param path: manifest 파일 경로
+    :param entries: [{board, reference, class}, ...]
+    :return: 저장한 보드 수
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    count = 0
+    # The inspection stage never reads a half-written manifest.
+    tmp_file = path + '.{}.tmp'.format(os.getpid())
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            count += 1
+    os.replace(tmp_file, path)
+
+    return count
+
+
+def read_manifest(path, classes=None):
+    """
+    manifest 를 한 줄씩 읽음 (전체를 메모리에 올리지 않음)
+    보드 / 기준 이미지 파일이 없거나 분류가 classes 에 없는 항목은 알리고 건너뜀 (한 보드 때문에 전체 검사가 멈추지 않도록)
+    Keyword arguments:
+    :param path: manifest 파일 경로
+    :param classes: 검사할 분류 폴더 이름 (None 이면 확인하지 않음)
+    :return: {board, reference, class} iterator
+    """
+    classes = set(classes) if classes is not None else None
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                raise ValueError('{}:{}: invalid manifest line'.format(path, number))
+            problem = entry_problem(entry, classes)
+            if problem is not None:
+                print(' {}:{}: {}, 건너뜀'.format(path, number, problem))
+                continue
+            yield entry
+
+
+def entry_problem(entry, classes=None):
+    """
+    manifest 항목을 검사할 수 없는 이유 (검사할 수 있으면 None)
+    Keyword arguments:
+    :param entry: {board, reference, class}
+    :param classes: 검사할 분류 폴더 이름 set (None 이면 확인하지 않음)
+    :return: 이유 문자열
+    """
+    if not isinstance(entry, dict) or not entry.get('board') or 'class' not in entry:
+        return 'missing board or class'
+    if not os.path.isfile(entry['board']):
+        return 'board not found: {}'.format(entry['board'])
+    if entry.get('reference') and not os.path.isfile(entry['reference']):
+        return 'reference not found: {}'.format(entry['reference'])
+    if classes is not None and entry['class'] not in classes:
+        return 'unknown class: {}'.format(entry['class'])
+
+    return None
+
+
+def count_manifest(path):
+    """manifest 의 보드 수 (진행률 계산용, JSON 은 해석하지 않음)"""
+    with open(path, 'rb') as f:
+        return sum(1 for line in f if line.strip())
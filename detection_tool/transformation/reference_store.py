@@ -0,0 +1,192 @@
+import collections
+import hashlib
+import threading
+import json
+import numpy as np
+import cv2
+import os
+
+from detection_tool.transformation.image_function import Image
+from detection_tool.transformation.image_function import ORB_FEATURES
+from detection_tool.transformation.image_function import BLUR_KSIZE
+from detection_tool.transformation.image_function import THRESH_BLOCK_SIZE
+from detection_tool.transformation.image_function import THRESH_C
+
+FIDUCIAL_LABEL = 'fiducial'
+
+
+def fiducial_file(path):
+    """기준 이미지의 fiducial 정의 파일 (같은 이름의 LabelFile JSON)"""
+    return os.path.splitext(path)[0] + '.json'
+
+
+def load_fiducials(path):
+    """
+    기준 이미지 옆 LabelFile JSON 에서 'fiducial' 사각형 영역 읽기
+    Keyword arguments:
+    :param path: 기준 이미지 경로
+    :return: fiducial 영역 (K, 4) [x, y, w, h]
+    """
+    rects = []
+    if os.path.exists(fiducial_file(path)):
+        with open(fiducial_file(path), 'r', encoding='utf-8') as f:
+            shapes = json.load(f).get('shapes', [])
+        for shape in shapes:
+            if shape.get('label') != FIDUCIAL_LABEL or shape.get('shape_type', 'polygon') != 'rectangle':
+                continue
+            (x1, y1), (x2, y2) = shape['points'][:2]
+            x, y = int(round(min(x1, x2))), int(round(min(y1, y2)))
+            rects.append((x, y, int(round(max(x1, x2))) - x, int(round(max(y1, y2))) - y))
+
+    return np.array(rects, dtype=np.int64).reshape(-1, 4)
+
+
+class Reference:
+    """기준(golden) 이미지에서 한 번만 계산되는 특징 묶음."""
+    def __init__(self, path, gray, binary, keypoints, descriptors, fiducials=None):
+        """
+        Keyword arguments:
+        :param path: 기준 이미지 경로
+        :param gray: 흑백 기준 이미지
+        :param binary: image_comparison 과 같은 방식으로 이진화된 기준 이미지
+        :param keypoints: ORB 특징점 좌표 (N, 2)
+        :param descriptors: ORB 기술자 (N, 32)
+        :param fiducials: fiducial 마크 영역 (K, 4) [x, y, w, h]
+        """
+        self.path = path
+        self.gray = gray
+        self.binary = binary
+        self.keypoints = keypoints
+        self.descriptors = descriptors
+        self.fiducials = fiducials if fiducials is not None else np.zeros((0, 4), dtype=np.int64)
+        self._levels = {}
+
+    @property
+    def shape(self):
+        return self.gray.shape
+
+    def features(self, scale, n_features):
+        """
+        축소된 기준 이미지의 ORB 특징 (피라미드 정합용, 메모리에만 보관)
+        Keyword arguments:
+        :param scale: 축소 비율
+        :param n_features: 특징점 수
+        :return keypoints, descriptors: 축소 이미지 좌표계의 특징점, 기술자
+        """
+        key = (scale, n_features)
+        if key not in self._levels:
+            gray = cv2.resize(self.gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            self._levels[key] = Image().orb_features(gray, n_features)
+
+        return self._levels[key]
+
+    def screening_binary(self, scale):
+        """
+        저해상도 선별용 이진 기준 이미지 (메모리에만 보관)
+        Keyword arguments:
+        :param scale: 축소 비율
+        :return: 축소 후 이진화된 기준 이미지
+        """
+        key = ('binary', scale)
+        if key not in self._levels:
+            gray = cv2.resize(self.gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            self._levels[key] = Image().binarization(gray)
+
+        return self._levels[key]
+
+
+class ReferenceStore:
+    """
+    기준 이미지 특징 저장소.
+    메모리(LRU) 와 디스크(npz) 두 단계로 캐시하며, 키는 경로 + 수정 시각 + 파라미터로 만든다.
+    """
+    def __init__(self, cache_path=None, capacity=4, n_features=ORB_FEATURES):
+        """
+        Keyword arguments:
+        :param cache_path: npz 캐시 저장 위치 (None 이면 메모리만 사용)
+        :param capacity: 메모리에 유지할 기준 이미지 수
+        :param n_features: ORB 특징점 수
+        """
+        self.cache_path = cache_path
+        self.capacity = capacity
+        self.n_features = n_features
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.cache_path is not None and not os.path.exists(self.cache_path):
+            os.makedirs(self.cache_path, exist_ok=True)
+
+    def key(self, path):
+        """경로, 수정 시각, 파라미터로 캐시 키 생성 (fiducial 정의 파일 포함)"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        fiducial_mtime = os.stat(fiducial_file(path)).st_mtime_ns if os.path.exists(fiducial_file(path)) else None
+        params = (self.n_features, BLUR_KSIZE, THRESH_BLOCK_SIZE, THRESH_C)
+        text = '|'.join(map(str, (path, stat.st_mtime_ns, stat.st_size, fiducial_mtime, params)))
+
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, path):
+        """
+        기준 이미지 특징 반환 (메모리 -> 디스크 -> 새로 계산 순)
+        Keyword arguments:
+        :param path: 기준 이미지 경로
+        :return: Reference
+        """
+        key = self.key(path)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        reference = self._load(key, path)
+        if reference is None:
+            reference = self._compute(path)
+            self._save(key, reference)
+
+        with self._lock:
+            self._memory[key] = reference
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.capacity:
+                self._memory.popitem(last=False)
+
+        return reference
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    def _compute(self, path):
+        image = cv2.imread(path)
+        if image is None:
+            raise IOError('Failed to read reference image: {}'.format(path))
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        binary = Image().binarization(gray)
+        keypoints, descriptors = Image().orb_features(gray, self.n_features)
+
+        return Reference(path, gray, binary, keypoints, descriptors, load_fiducials(path))
+
+    def _file(self, key):
+        return os.path.join(self.cache_path, key + '.npz')
+
+    def _load(self, key, path):
+        if self.cache_path is None or not os.path.exists(self._file(key)):
+            return None
+        try:
+            with np.load(self._file(key)) as data:
+                return Reference(path, data['gray'], data['binary'], data['keypoints'], data['descriptors'],
+                                 data['fiducials'])
+        except (IOError, ValueError, KeyError):
+            return None
+
+    def _save(self, key, reference):
+        if self.cache_path is None:
+            return
+        # Write to a temporary file first so concurrent readers never see a partial npz.
+        tmp_file = self._file(key) + '.{}.{}.tmp'.format(os.getpid(), threading.get_ident())
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, gray=reference.gray, binary=reference.binary,
+                     keypoints=reference.keypoints, descriptors=reference.descriptors,
+                     fiducials=reference.fiducials)
+        os.replace(tmp_file, self._file(key))
@@ -0,0 +1,239 @@
+import argparse
+import binascii
+import shutil
+import json
+import time
+import os
+
+LATEST_FILE = 'LATEST'
+RUN_FILE = 'run.json'
+STAGING_SUFFIX = '.tmp'
+KEEP_RUNS = 20  # published runs kept by prune
+STAGING_GRACE = 60 * 60  # seconds before a staging directory without a readable run.json counts as abandoned
+# paths entries a run writes to, and where they go inside the run directory.
+RUN_DIRS = {'crop_path': 'crop', 'crop_store_path': 'crop_store', 'eval_result_path': 'evaluation',
+            'label_path': 'labels', 'labeled_path': 'labeled', 'origin_path': 'origin', 'xor_result_path': 'xor'}
+# Files keep their configured name, e.g. eval_result_path_text -> <run>/evaluation/result1220.txt
+RUN_FILES = {'eval_result_path_text': 'evaluation', 'eval_result_path_total': 'evaluation', 'manifest_path': ''}
+
+
+def pid_alive(pid):
+    """이 컴퓨터에서 pid 프로세스가 실행 중인지"""
+    if os.name == 'nt':
+        # os.kill on Windows terminates the process instead of probing it.
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+def new_run_id():
+    """시간 순으로 정렬되고, 같은 시각에 시작한 실행끼리도 겹치지 않는 실행 id"""
+    return '{}-{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid(),
+                             binascii.hexlify(os.urandom(3)).decode('ascii'))
+
+
+class RunWorkspace:
+    """
+    검사 / 분류 실행 하나의 작업 공간 (<runs_path>/<run id>/).
+    실행 중에는 <run id>.tmp 에 쓰고 publish 에서 디렉터리 이름을 바꾸므로, 다른 실행이나 화면은 끝난 결과만 본다.
+    마지막으로 publish 된 실행 id 는 <runs_path>/LATEST 에 기록한다.
+    annotation: label 의 검출 결과 JSON 도 테스트 이미지 옆이 아니라 작업 공간의 labels/<분류 폴더>/ 에 쓰므로,
+    같은 보드를 검사하는 실행끼리 덮어쓰지 않고 실패한 실행의 결과는 discard 와 함께 지워진다.
+    실행마다 결과 전체를 복사해 두므로, publish 후 prune 으로 오래된 실행을 지운다.
+    """
+    def __init__(self, runs_path, run_id, published=False):
+        """
+        Keyword arguments:
+        :param runs_path: 실행 디렉터리들의 상위 디렉터리
+        :param run_id: 실행 id
+        :param published: publish 된 실행인지
+        """
+        self.runs_path = runs_path
+        self.run_id = run_id
+        self.published = published
+
+    @property
+    def path(self):
+        return os.path.join(self.runs_path, self.run_id if self.published else self.run_id + STAGING_SUFFIX)
+
+    @classmethod
+    def create(cls, runs_path, run_id=None):
+        """
+        새 작업 공간 생성
+        Keyword arguments:
+        :param runs_path: 실행 디렉터리들의 상위 디렉터리
+        :param run_id: 실행 id (None 이면 new_run_id)
+        :return: RunWorkspace
+        """
+        workspace = cls(os.path.abspath(runs_path), run_id or new_run_id())
+        # exist_ok=False: two runs never share a directory, even with a caller-chosen id.
+        os.makedirs(workspace.path)
+        for directory in set(RUN_DIRS.values()):
+            os.makedirs(os.path.join(workspace.path, directory))
+        workspace.write_info(status='running', created=time.strftime('%Y-%m-%d %H:%M:%S'), pid=os.getpid())
+
+        return workspace
+
+    @classmethod
+    def latest(cls, runs_path):
+        """마지막으로 publish 된 작업 공간 (없으면 None)"""
+        runs_path = os.path.abspath(runs_path)
+        try:
+            with open(os.path.join(runs_path, LATEST_FILE), 'r', encoding='utf-8') as f:
+                run_id = f.read().strip()
+        except IOError:
+            return None
+        workspace = cls(runs_path, run_id, published=True)
+
+        return workspace if run_id and os.path.isdir(workspace.path) else None
+
+    def paths(self, path_info):
+        """
+        설정의 paths 항목에서 실행 결과 경로를 이 작업 공간 안으로 바꾼 사본
+        Keyword arguments:
+        :param path_info: 설정 파일의 paths 항목
+        :return: paths (run_path 는 작업 공간 경로)
+        """
+        paths = dict(path_info)
+        # Only entries the configuration uses are moved, so a disabled crop store stays disabled.
+        for key, directory in RUN_DIRS.items():
+            if path_info.get(key):
+                paths[key] = os.path.join(self.path, directory, '')
+        for key, directory in RUN_FILES.items():
+            if path_info.get(key):
+                paths[key] = os.path.join(self.path, directory, os.path.basename(path_info[key]))
+        paths['run_path'] = self.path
+
+        return paths
+
+    def info(self):
+        """run.json 내용"""
+        with open(os.path.join(self.path, RUN_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def write_info(self, **kwargs):
+        """run.json 에 항목 추가 / 변경"""
+        run_file = os.path.join(self.path, RUN_FILE)
+        info = self.info() if os.path.exists(run_file) else {'run_id': self.run_id}
+        info.update(kwargs)
+        tmp_file = run_file + '.{}.tmp'.format(os.getpid())
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, run_file)
+
+    def publish(self):
+        """
+        실행 결과를 <runs_path>/<run id> 로 옮기고 LATEST 를 이 실행으로 바꿈
+        :return: 결과 디렉터리
+        """
+        if self.published:
+            return self.path
+        self.write_info(status='complete', published=time.strftime('%Y-%m-%d %H:%M:%S'))
+        staging_path = self.path
+        self.published = True
+        # A directory rename is atomic: readers see either no run or the whole run.
+        os.replace(staging_path, self.path)
+
+        tmp_file = os.path.join(self.runs_path, LATEST_FILE + '.{}.tmp'.format(os.getpid()))
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(self.run_id)
+        os.replace(tmp_file, os.path.join(self.runs_path, LATEST_FILE))
+
+        return self.path
+
+    def discard(self):
+        """publish 하지 않은 작업 공간 삭제 (실패한 실행)"""
+        if not self.published:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    @classmethod
+    def prune(cls, runs_path, keep=KEEP_RUNS, max_age=None):
+        """
+        오래된 실행 삭제. LATEST 실행은 항상 남긴다.
+        실행 중에 죽은 프로세스 (GUI, 배치 작업) 가 남긴 <run id>.tmp 도 지운다.
+        Keyword arguments:
+        :param runs_path: 실행 디렉터리들의 상위 디렉터리
+        :param keep: 남길 publish 된 실행 수 (None 이면 수로는 지우지 않음)
+        :param max_age: 이보다 오래된 실행 삭제 (일, None 이면 나이로는 지우지 않음)
+        :return: 지운 디렉터리 수
+        """
+        runs_path = os.path.abspath(runs_path)
+        if not os.path.isdir(runs_path):
+            return 0
+        latest = cls.latest(runs_path)
+        now = time.time()
+        removed = []
+        published = []
+        for name in os.listdir(runs_path):
+            path = os.path.join(runs_path, name)
+            if not os.path.isdir(path):
+                continue
+            if name.endswith(STAGING_SUFFIX):
+                try:
+                    with open(os.path.join(path, RUN_FILE), 'r', encoding='utf-8') as f:
+                        abandoned = not pid_alive(json.load(f)['pid'])
+                except (IOError, ValueError, KeyError):
+                    # Killed before run.json was written.
+                    abandoned = now - os.path.getmtime(path) > STAGING_GRACE
+                if abandoned:
+                    removed.append(path)
+            elif os.path.exists(os.path.join(path, RUN_FILE)) and (latest is None or name != latest.run_id):
+                published.append(name)
+
+        # Run ids start with their creation time, so name order is age order; LATEST counts towards keep.
+        published.sort(reverse=True)
+        limit = None if keep is None else max(keep - (latest is not None), 0)
+        for i, name in enumerate(published):
+            path = os.path.join(runs_path, name)
+            # run.json is written last by publish.
+            age = now - os.path.getmtime(os.path.join(path, RUN_FILE))
+            if (limit is not None and i >= limit) or (max_age is not None and age > max_age * 24 * 60 * 60):
+                removed.append(path)
+        for path in removed:
+            shutil.rmtree(path, ignore_errors=True)
+
+        return len(removed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Per-run workspaces for batch jobs (demo_xor / demo_evaluation).')
+    parser.add_argument("action", choices=('create', 'publish', 'discard', 'latest', 'prune'))
+    parser.add_argument("-r", "--runs_path", help="Directory holding the run directories.", required=True)
+    parser.add_argument("-p", "--path_info", help="Path information (create prints it rewritten into the run).",
+                        default='{}')
+    parser.add_argument("--run_id", help="Run id (create: optional, publish / discard: required).")
+    parser.add_argument("--keep", help="Published runs kept by prune.", type=int, default=KEEP_RUNS)
+    parser.add_argument("--max_age_days", help="Prune runs older than this.", type=float, default=None)
+    args = parser.parse_args()
+
+    if args.action == 'create':
+        workspace = RunWorkspace.create(args.runs_path, args.run_id)
+        print(workspace.run_id)
+        print(workspace.paths(eval(args.path_info)))
+    elif args.action == 'prune':
+        print(RunWorkspace.prune(args.runs_path, keep=args.keep, max_age=args.max_age_days))
+    elif args.action == 'latest':
+        workspace = RunWorkspace.latest(args.runs_path)
+        print(workspace.path if workspace is not None else '')
+    else:
+        if not args.run_id:
+            parser.error('{} needs --run_id'.format(args.action))
+        workspace = RunWorkspace(os.path.abspath(args.runs_path), args.run_id)
+        if args.action == 'publish':
+            print(workspace.publish())
+        else:
+            workspace.discard()
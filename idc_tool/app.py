@@ -18,6 +18,7 @@ from idc_tool.logger import logger
 from idc_tool.config import get_config
 from idc_tool.label_file import LabelFile
 from idc_tool.label_file import LabelFileError
+from idc_tool.shape import Shape
 from idc_tool.widgets import LabelDialog
 from idc_tool.widgets import LabelQListWidget
 from idc_tool.widgets import CanvasInit
@@ -28,6 +29,14 @@ from idc_tool.docks.property_dock import PropertyDock
 from idc_tool.docks.defect_dock import DefectDock
 from idc_tool.docks.file_dock import FileDock
 from idc_tool.docks.category_dock import CategoryDock
+from detection_tool.transformation.crop_batch import CropBatch
+from detection_tool.transformation.crop_batch import CROP_BATCH_FILE
+from detection_tool.transformation.crop_store import CropStore
+from detection_tool.transformation.manifest import manifest_entry
+from detection_tool.transformation.manifest import write_manifest
+from detection_tool.transformation.workspace import RunWorkspace
+from detection_tool.transformation.workspace import KEEP_RUNS
+from detection_tool.transformation.defect_labels import label_file_path
 
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -84,7 +93,10 @@ class MainWindow(QtWidgets.QMainWindow):
         self.inference_dock = self.inference.inference_dock
         self.property = PropertyDock(config=self._config)
         self.property_dock = self.property.property_dock
-        self.defect = DefectDock(path_info=self._config['paths'])
+        # Until the first analysis the defect dock shows the last published run.
+        latest = RunWorkspace.latest(self._config['paths']['runs_path'])
+        self.defect = DefectDock(path_info=latest.paths(self._config['paths']) if latest is not None
+                                 else self._config['paths'])
         self.defect_dock = self.defect.defect_dock
         self.file = FileDock(parent=self)
         self.file_dock = self.file.file_dock
@@ -280,6 +292,10 @@ class MainWindow(QtWidgets.QMainWindow):
         if self.output_dir:
             label_file_without_path = osp.basename(label_file)
             label_file = osp.join(self.output_dir, label_file_without_path)
+        run_label_path = self.defect.path_info.get('label_path')
+        if run_label_path and osp.isfile(label_file_path(filename, run_label_path)):
+            # Detection overlays of the shown run are kept in its workspace, not next to the image.
+            label_file = label_file_path(filename, run_label_path)
 
         if QtCore.QFile.exists(label_file) and LabelFile.is_label_file(label_file):
             try:
@@ -344,6 +360,36 @@ class MainWindow(QtWidgets.QMainWindow):
 
         return True
 
+    def loadLabels(self, shapes):
+        """LabelFile 의 shape 항목 (label, points, line_color, fill_color, shape_type, flags) 을 Canvas 도형으로 표시"""
+        s = []
+        for label, points, line_color, fill_color, shape_type, flags in shapes:
+            shape = Shape(label=label, shape_type=shape_type, flags=flags)
+            for x, y in points:
+                shape.addPoint(QtCore.QPointF(x, y))
+            shape.close()
+            if line_color:
+                shape.line_color = QtGui.QColor(*line_color)
+            if fill_color:
+                shape.fill_color = QtGui.QColor(*fill_color)
+            s.append(shape)
+        self.loadShapes(s)
+
+    def loadShapes(self, shapes, replace=True):
+        for shape in shapes:
+            item = QtWidgets.QListWidgetItem(shape.label)
+            self.labelList.itemsToShapes.append((item, shape))
+            self.labelList.addItem(item)
+        self.canvas.loadShapes(shapes, replace=replace)
+
+    def loadFlags(self, flags):
+        self.flag_widget.clear()
+        for key, flag in flags.items():
+            item = QtWidgets.QListWidgetItem(key)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if flag else Qt.Unchecked)
+            self.flag_widget.addItem(item)
+
     def setDirty(self):
         self.dirty = True
         self.actions.analysis.setEnabled(True)
@@ -476,55 +522,82 @@ class MainWindow(QtWidgets.QMainWindow):
                 if self.single_analysis_file:
                     checked_items.append(self.single_analysis_file)
 
-            script = ['python', '../detection_tool/demo_xor.py']
-            script.append('-i')
-            script.extend(checked_items)
-            script.append('-c')
-            script.append(str(self._config['classes']))
-            script.append('-p')
-            script.append(str(self._config['paths']))
-            detect_result = subprocess.run(script, capture_output=True)
-            print(detect_result)  # xor 2020.02.13
-
-            if detect_result.returncode == 0:
-                script = ['python', '../detection_tool/demo_evaluation.py']
+            # Every run writes into its own workspace, so analyses started at the same time do not collide.
+            workspace = RunWorkspace.create(self._config['paths']['runs_path'])
+            try:
+                path_info = workspace.paths(self._config['paths'])
+
+                # The selection goes through a manifest file, so its size is not limited by the command line.
+                manifest_path = path_info['manifest_path']
+                write_manifest(manifest_path, (manifest_entry(item, path_info['xor_normal_path'])
+                                               for item in checked_items))
+
+                script = ['python', '../detection_tool/demo_xor.py']
                 script.append('-m')
-                script.append(str(self._config['model_type']))
+                script.append(manifest_path)
                 script.append('-c')
                 script.append(str(self._config['classes']))
                 script.append('-p')
-                script.append(str(self._config['paths']))
-                classification_result = subprocess.run(script, capture_output=True)
-                print(classification_result)  # xor 2020.02.13
-
-                if classification_result.returncode == 0:
-                    success_message = QtWidgets.QMessageBox()
-                    success_message.setWindowTitle('Success !')
-                    success_message.setIcon(QtWidgets.QMessageBox.Information)
-                    success_message.setText('Analysis has been completed.')
-                    success_message.exec_()
-                    print("Classfication Completed ")
-
-                    if self.file_dock.isEnabled() is True:
-                        items = self.file.fileListWidget.selectedItems()
-                        if not items:
-                            return
-                        item = items[0]
-                        if not self.mayContinue():
-                            return
-                        currIndex = self.file.imageList().index(str(item.text()))
-                        if currIndex < len(self.file.imageList()):
-                            filename = self.file.imageList()[currIndex]
-                            if filename:
-                                self.loadFile(filename)
-                    else:
-                        self.loadFile(self.single_analysis_file)
-            else:
-                print("Defect Detection fail")
-
-            result_path_total = self._config['paths']['eval_result_path_total']
-            result_path_text = self._config['paths']['eval_result_path_text']
-            labeled_path = self._config['paths']['labeled_path']
+                script.append(str(path_info))
+                script.append('-d')
+                script.append(str(self._config['detection']))
+                detect_result = subprocess.run(script, capture_output=True)
+                print(detect_result)  # xor 2020.02.13
+
+                if detect_result.returncode == 0:
+                    script = ['python', '../detection_tool/demo_evaluation.py']
+                    script.append('-m')
+                    script.append(str(self._config['model_type']))
+                    script.append('-c')
+                    script.append(str(self._config['classes']))
+                    script.append('-p')
+                    script.append(str(path_info))
+                    classification_result = subprocess.run(script, capture_output=True)
+                    print(classification_result)  # xor 2020.02.13
+
+                    if classification_result.returncode == 0:
+                        # Results become visible only once both stages have finished.
+                        workspace.publish()
+                        runs_info = self._config['detection'].get('runs', {})
+                        RunWorkspace.prune(self._config['paths']['runs_path'], keep=runs_info.get('keep', KEEP_RUNS),
+                                           max_age=runs_info.get('max_age_days'))
+                        path_info = workspace.paths(self._config['paths'])
+                        self.defect.path_info = path_info
+                        self.category.labeled_path = path_info['labeled_path']
+
+                        success_message = QtWidgets.QMessageBox()
+                        success_message.setWindowTitle('Success !')
+                        success_message.setIcon(QtWidgets.QMessageBox.Information)
+                        success_message.setText('Analysis has been completed.')
+                        success_message.exec_()
+                        print("Classfication Completed ")
+
+                        if self.file_dock.isEnabled() is True:
+                            items = self.file.fileListWidget.selectedItems()
+                            if not items:
+                                return
+                            item = items[0]
+                            if not self.mayContinue():
+                                return
+                            currIndex = self.file.imageList().index(str(item.text()))
+                            if currIndex < len(self.file.imageList()):
+                                filename = self.file.imageList()[currIndex]
+                                if filename:
+                                    self.loadFile(filename)
+                        else:
+                            self.loadFile(self.single_analysis_file)
+                else:
+                    print("Defect Detection fail")
+            finally:
+                # Also when a stage or the result dialog raises; only a published run is kept.
+                if not workspace.published:
+                    workspace.discard()
+            if not workspace.published:
+                return
+
+            result_path_total = path_info['eval_result_path_total']
+            result_path_text = path_info['eval_result_path_text']
+            labeled_path = path_info['labeled_path']
 
             pixmap = QPixmap(result_path_total)
             pixmap = pixmap.scaled(QSize(min(self.size().width(), 384), min(self.size().height(), 384)),
@@ -541,17 +614,27 @@ class MainWindow(QtWidgets.QMainWindow):
 
             classes = self._config['classes']
             labeled_file_list = {}
-            for i in result_value[3:]:
-                if i != -1:
-                    file_path = os.path.abspath(os.path.join(labeled_path, classes[int(i)]))
-                    if os.path.exists(file_path):
-                        for file in os.listdir(file_path):
-                            labeled_file_list.__setitem__(file, {'path': file_path, 'class': classes[int(i)]})
-                else:
-                    nonlabel_path = os.path.abspath(os.path.join(labeled_path, 'None'))
-                    if os.path.exists(nonlabel_path):
-                        for file in os.listdir(nonlabel_path):
-                            labeled_file_list.__setitem__(file, {'path': nonlabel_path, 'class': 'None'})
+            crop_store_path = path_info.get('crop_store_path')
+            crop_batch_file = os.path.join(path_info['crop_path'], CROP_BATCH_FILE)
+            if crop_store_path and os.path.exists(crop_batch_file):
+                # Crops of this run are read from the packed store by the ids demo_xor recorded.
+                if self.category.crop_store is not None:
+                    self.category.crop_store.close()
+                self.category.crop_store = CropStore(os.path.abspath(crop_store_path))
+                for record in self.category.crop_store.records(CropBatch.load(crop_batch_file).ids):
+                    labeled_file_list.__setitem__(record['name'], {'id': record['id'], 'class': record['class']})
+            else:
+                for i in result_value[3:]:
+                    if i != -1:
+                        file_path = os.path.abspath(os.path.join(labeled_path, classes[int(i)]))
+                        if os.path.exists(file_path):
+                            for file in os.listdir(file_path):
+                                labeled_file_list.__setitem__(file, {'path': file_path, 'class': classes[int(i)]})
+                    else:
+                        nonlabel_path = os.path.abspath(os.path.join(labeled_path, 'None'))
+                        if os.path.exists(nonlabel_path):
+                            for file in os.listdir(nonlabel_path):
+                                labeled_file_list.__setitem__(file, {'path': nonlabel_path, 'class': 'None'})
 
             for file in labeled_file_list.keys():
                 self.category.crop_image_list.addItem(file)
@@ -1,3 +1,4 @@
+import numpy as np
 import os
 import shutil
 import yaml
@@ -6,6 +7,7 @@ from qtpy import QtWidgets
 
 from PyQt5.QtCore import Qt, QSize
 from PyQt5.QtGui import QPixmap
+from PyQt5.QtGui import QImage
 
 from idc_tool.config import get_config
 
@@ -37,6 +39,8 @@ class CategoryDock(QtWidgets.QWidget):
         self.selected_file_path = None
         self.selected_file_name = None
         self.selected_file_type = None
+        self.crop_store = None
+        self.labeled_path = None
         self.init_UI()
 
     def init_UI(self):
@@ -156,11 +160,21 @@ class CategoryDock(QtWidgets.QWidget):
 
     def category_save(self):
         try:
-            config = get_config()
-            labeled_path = config['paths']['labeled_path']
+            # Crops are moved within the workspace of the run they came from.
+            labeled_path = self.labeled_path or get_config()['paths']['labeled_path']
 
             file_name = self.selected_file_name
             ch_category = self.catListWidget.currentText()
+
+            if 'id' in self.labeled_file_list[file_name]:
+                # Stored crops are relabelled in the index; nothing is moved on disk.
+                self.crop_store.relabel(self.labeled_file_list[file_name]['id'], ch_category)
+                self.crop_store.flush()
+                self.labeled_file_list[file_name]['class'] = ch_category
+                QtWidgets.QMessageBox.about(self, "message", "Move Category\n(%s -> %s)"
+                                            % (self.selected_file_type, ch_category))
+                return
+
             src_dir = os.path.abspath(self.selected_file_path)
             dst_dir = os.path.abspath(os.path.join(labeled_path, ch_category))
 
@@ -182,12 +196,18 @@ class CategoryDock(QtWidgets.QWidget):
             current_item = self.crop_image_list.currentItem()
 
             self.selected_file_name = current_item.text()
-            self.selected_file_path = self.labeled_file_list[self.selected_file_name]['path']
+            self.selected_file_path = self.labeled_file_list[self.selected_file_name].get('path')
             self.selected_file_type = self.labeled_file_list[self.selected_file_name]['class']
 
             self.catListWidget.setCurrentIndex(self.classes.index(self.selected_file_type))
 
-            img = QPixmap(os.path.abspath(os.path.join(self.selected_file_path, self.selected_file_name)))
+            if 'id' in self.labeled_file_list[self.selected_file_name]:
+                crop = self.crop_store.read(self.labeled_file_list[self.selected_file_name]['id'])
+                rgb = np.ascontiguousarray(crop[..., ::-1])
+                img = QPixmap.fromImage(QImage(rgb.data, rgb.shape[1], rgb.shape[0], 3 * rgb.shape[1],
+                                               QImage.Format_RGB888))
+            else:
+                img = QPixmap(os.path.abspath(os.path.join(self.selected_file_path, self.selected_file_name)))
             img = img.scaled(QSize(min(self.size().width(), 64), min(self.size().height(), 64)),
                        Qt.KeepAspectRatioByExpanding, Qt.FastTransformation)
 
@@ -5,6 +5,7 @@ from qtpy import QtWidgets
 
 from idc_tool.utils import defect_info
 from idc_tool.widgets import DefectWindow
+from detection_tool.transformation.defect_labels import find_label_file
 
 
 class DefectDock:
@@ -31,6 +32,10 @@ class DefectDock:
         for path in str(filename).split('/')[-2:]:
             origin_path = osp.join(origin_path, path)
             result_path = osp.join(result_path)
+        label_file = find_label_file(str(filename), self.path_info.get('label_path'))
+        if not os.path.isfile(origin_path) and os.path.isfile(label_file):
+            # annotation: label keeps the defects as overlays of the source image instead of a redrawn board.
+            origin_path = str(filename)
 
         if os.path.isfile(origin_path):
             self.defect.defect_macro_info(origin_path)